@@ -2,7 +2,23 @@ import tempfile
 
 import pytest
 from mixer.backend.django import mixer as _mixer
+from posts.kvstore import KVStore
 from posts.models import Post, Group
+from sorl.thumbnail import default
+
+
+@pytest.fixture(autouse=True)
+def isolated_files(settings, tmp_path, monkeypatch):
+    """Keep uploads, thumbnails and their keys out of the project tree.
+
+    Tests run with transaction=True, so on_commit hooks fire: background
+    thumbnail workers are switched off as well.
+    """
+    settings.MEDIA_ROOT = str(tmp_path / 'media')
+    settings.RESIZE_CACHE_DIR = str(tmp_path / 'resize_cache')
+    settings.THUMBNAIL_KVSTORE_FILE = str(tmp_path / 'kvstore.sqlite3')
+    settings.THUMBNAIL_WORKERS = 0
+    monkeypatch.setattr(default, 'kvstore', KVStore())
 
 
 @pytest.fixture()
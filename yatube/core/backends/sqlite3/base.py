@@ -0,0 +1,17 @@
+"""
+SQLite, у которого транзакция сразу берёт блокировку на запись.
+
+Django открывает transaction.atomic командой BEGIN, то есть отложенной
+транзакцией: представление сначала читает, а первая запись пытается
+повысить блокировку. В режиме WAL это сразу, без ожидания busy_timeout,
+падает с «database is locked», если другой писатель успел зафиксировать
+изменения. BEGIN IMMEDIATE ждёт блокировку на запись заранее.
+"""
+from django.db.backends.sqlite3 import base
+
+BEGIN = 'BEGIN IMMEDIATE'
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(BEGIN)
@@ -0,0 +1,150 @@
+"""
+Нагрузочное сравнение настроек SQLite.
+
+Несколько потоков одновременно читают страницы комментариев и добавляют
+комментарии в отдельные временные базы: с настройками по умолчанию и
+новым соединением на каждый запрос, как сейчас, с PRODUCTION_PRAGMAS и
+постоянным соединением, но отложенной транзакцией, и с профилем
+yatube.settings_production целиком, где транзакция начинается с
+BEGIN IMMEDIATE.
+"""
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from core.backends.sqlite3.base import BEGIN as BEGIN_IMMEDIATE
+from core.db import PRODUCTION_PRAGMAS, apply_pragmas
+
+# Имя, PRAGMA, постоянное соединение, команда начала транзакции.
+PROFILES = (
+    ('default', {}, False, 'BEGIN'),
+    ('wal-deferred', PRODUCTION_PRAGMAS, True, 'BEGIN'),
+    ('production', PRODUCTION_PRAGMAS, True, BEGIN_IMMEDIATE),
+)
+POSTS = 100
+
+SCHEMA = (
+    'CREATE TABLE post (id INTEGER PRIMARY KEY, '
+    'comments_count INTEGER NOT NULL DEFAULT 0)',
+    'CREATE TABLE comment (id INTEGER PRIMARY KEY, post_id INTEGER, '
+    'text TEXT, created REAL)',
+    'CREATE INDEX comment_post ON comment (post_id, created)',
+)
+
+
+def connect(path, pragmas):
+    # isolation_level=None: транзакциями управляем сами, как Django.
+    db = sqlite3.connect(path, isolation_level=None)
+    apply_pragmas(db, pragmas)
+    return db
+
+
+def prepare(path, pragmas):
+    db = connect(path, pragmas)
+    for statement in SCHEMA:
+        db.execute(statement)
+    db.executemany('INSERT INTO post (id) VALUES (?)',
+                   [(i,) for i in range(1, POSTS + 1)])
+    db.close()
+
+
+def read_page(db, post_id):
+    db.execute(
+        'SELECT id, text FROM comment WHERE post_id = ? '
+        'ORDER BY created DESC LIMIT 20', (post_id,)).fetchall()
+    db.execute('SELECT comments_count FROM post WHERE id = ?',
+               (post_id,)).fetchone()
+
+
+def add_comment(db, post_id, begin):
+    # Как add_comment: transaction.atomic сразу шлёт BEGIN, и внутри
+    # транзакции пост сначала читается, а потом пишутся комментарий и
+    # счётчик.
+    db.execute(begin)
+    try:
+        db.execute('SELECT id FROM post WHERE id = ?',
+                   (post_id,)).fetchone()
+        db.execute(
+            'INSERT INTO comment (post_id, text, created) VALUES (?, ?, ?)',
+            (post_id, 'Комментарий', time.time()))
+        db.execute('UPDATE post SET comments_count = comments_count + 1 '
+                   'WHERE id = ?', (post_id,))
+        db.execute('COMMIT')
+    except sqlite3.Error:
+        db.execute('ROLLBACK')
+        raise
+
+
+class Worker:
+    def __init__(self, path, pragmas, persistent, begin):
+        self.path = path
+        self.pragmas = pragmas
+        self.persistent = persistent
+        self.begin = begin
+        self.local = threading.local()
+
+    def connection(self):
+        if not self.persistent:
+            return connect(self.path, self.pragmas)
+        if not hasattr(self.local, 'db'):
+            self.local.db = connect(self.path, self.pragmas)
+        return self.local.db
+
+    def request(self, write):
+        started = time.perf_counter()
+        db = self.connection()
+        post_id = random.randint(1, POSTS)
+        try:
+            if write:
+                add_comment(db, post_id, self.begin)
+            else:
+                read_page(db, post_id)
+            error = None
+        except sqlite3.OperationalError as exc:
+            error = str(exc)
+        finally:
+            if not self.persistent:
+                db.close()
+        return time.perf_counter() - started, error
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает настройки SQLite под конкурентной нагрузкой'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--write-ratio', type=float, default=0.3)
+
+    def handle(self, *args, **options):
+        for name, pragmas, persistent, begin in PROFILES:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'bench.sqlite3')
+                prepare(path, pragmas)
+                self.report(name, self.run(
+                    Worker(path, pragmas, persistent, begin), options))
+
+    def run(self, worker, options):
+        writes = [random.random() < options['write_ratio']
+                  for _ in range(options['requests'])]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['workers']) as pool:
+            results = list(pool.map(worker.request, writes))
+        return time.perf_counter() - started, results
+
+    def report(self, name, run):
+        elapsed, results = run
+        latencies = sorted(latency for latency, _ in results)
+        errors = sum(1 for _, error in results if error)
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        self.stdout.write(
+            f'{name}: {len(results) / elapsed:.0f} запросов/с, '
+            f'медиана {statistics.median(latencies) * 1000:.2f} мс, '
+            f'p95 {p95 * 1000:.2f} мс, ошибок {errors}')
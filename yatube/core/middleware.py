@@ -0,0 +1,17 @@
+from .routers import PIN_COOKIE, pin_seconds, should_pin
+
+
+class ReplicaPinningMiddleware:
+    """После запроса, меняющего данные, закрепляет чтение за default."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if should_pin(request) and response.status_code < 400:
+            response.set_cookie(
+                PIN_COOKIE, '1',
+                max_age=pin_seconds(),
+                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,78 @@
+"""
+Чтение с реплик.
+
+Представления, помеченные декоратором read_from_replica, читают из
+случайной базы списка DATABASE_REPLICAS; всё остальное, включая любую
+запись, идёт в default. После запроса, меняющего данные, пользователь
+получает cookie и REPLICA_PIN_SECONDS секунд читает только из default,
+чтобы видеть свои изменения, пока реплика их догоняет. Пустой
+DATABASE_REPLICAS выключает маршрутизацию.
+
+Представление, которое пишет в базу в ответ на GET, вызывает pin(), чтобы
+клиент тоже получил cookie.
+
+Кэш страниц не полагается на закрепление: счётчики его версий лежат в
+базе и реплицируются вместе с данными, поэтому страница, собранная из
+отстающей реплики, получает её старое поколение и в кэше не считается
+свежей.
+"""
+import random
+import threading
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_COOKIE = 'db_pin'
+DEFAULT_PIN_SECONDS = 10
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+_state = threading.local()
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def pin_seconds():
+    return getattr(settings, 'REPLICA_PIN_SECONDS', DEFAULT_PIN_SECONDS)
+
+
+def is_pinned(request):
+    return PIN_COOKIE in request.COOKIES
+
+
+def pin(request):
+    """Закрепляет чтение клиента за default после записи в GET-запросе."""
+    request.pin_reads = True
+
+
+def should_pin(request):
+    return (request.method not in SAFE_METHODS
+            or getattr(request, 'pin_reads', False))
+
+
+def read_from_replica(view):
+    """Запросы на чтение внутри представления уходят на реплику."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not replicas() or is_pinned(request):
+            return view(request, *args, **kwargs)
+        _state.replica = random.choice(replicas())
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _state.replica = None
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return getattr(_state, 'replica', None)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики — копии default, объекты из них можно связывать.
+        return True
@@ -1,5 +1,14 @@
+import os
+import sqlite3
+import tempfile
+from io import StringIO
+
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.core.management import call_command
+from django.db.utils import ConnectionHandler
+from django.test import Client, SimpleTestCase, TestCase
+
+from .db import PRODUCTION_PRAGMAS
 
 User = get_user_model()
 
@@ -23,3 +32,53 @@ class ViewTestClass(TestCase):
             response = user.get(page)
             error_template = f'Ошибка: {page} ожидал шаблон {template}'
             self.assertTemplateUsed(response, template, error_template)
+
+
+class SQLitePragmasTests(SimpleTestCase):
+    def test_pragmas_on_connect(self):
+        """Новое соединение выполняет PRAGMA из настроек базы"""
+        with tempfile.TemporaryDirectory() as tmp:
+            connections = ConnectionHandler({'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(tmp, 'db.sqlite3'),
+                'PRAGMAS': PRODUCTION_PRAGMAS,
+            }})
+            connection = connections['default']
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+                    cursor.execute('PRAGMA busy_timeout')
+                    self.assertEqual(cursor.fetchone()[0], 20000)
+            finally:
+                connection.close()
+
+    def test_immediate_transactions(self):
+        """Транзакция боевого профиля сразу берёт блокировку на запись"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'db.sqlite3')
+            connections = ConnectionHandler({'default': {
+                'ENGINE': 'core.backends.sqlite3',
+                'NAME': path,
+                'PRAGMAS': PRODUCTION_PRAGMAS,
+            }})
+            connection = connections['default']
+            other = sqlite3.connect(path, timeout=0, isolation_level=None)
+            try:
+                # Так транзакцию открывает transaction.atomic.
+                connection.set_autocommit(
+                    False, force_begin_transaction_with_broken_autocommit=True)
+                with self.assertRaisesMessage(
+                        sqlite3.OperationalError, 'database is locked'):
+                    other.execute('BEGIN IMMEDIATE')
+            finally:
+                other.close()
+                connection.close()
+
+    def test_benchmark(self):
+        """Бенчмарк сравнивает оба профиля"""
+        out = StringIO()
+        call_command('bench_sqlite', requests=20, workers=2, stdout=out)
+        self.assertIn('default:', out.getvalue())
+        self.assertIn('wal-deferred:', out.getvalue())
+        self.assertIn('production:', out.getvalue())
@@ -0,0 +1,138 @@
+"""
+Горячие и холодные посты.
+
+Посты старше POST_ARCHIVE_AFTER_DAYS команда archive_posts пачками
+переносит из Post в ArchivedPost со сжатым текстом. Строки поискового
+индекса, записи лент подписок, комментарии и счётчики остаются как
+были. Главная, группа, профиль и страница поста читают оба яруса:
+find_post() ищет пост по id в обоих, TieredPaginator сливает выдачу по
+(pub_date, id). Правка или новый комментарий возвращают пост из архива
+в Post.
+"""
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.functional import cached_property
+
+from .cache import bump_generation
+from .models import ArchivedPost, Post
+from .paginators import (POST_KEYS, POSTS_ON_PAGE, CursorPaginator,
+                         get_page, keyset_slice)
+
+DEFAULT_ARCHIVE_AFTER_DAYS = 365
+COMPRESS_LEVEL = 9
+# Общие поля Post и ArchivedPost, кроме текста и картинки.
+COPIED_FIELDS = ('id', 'pub_date', 'author_id', 'group_id', 'image_width',
+                 'image_height', 'image_size', 'image_hash',
+                 'image_placeholder', 'image_variants', 'comments_count')
+
+
+def archive_after():
+    return timedelta(days=getattr(settings, 'POST_ARCHIVE_AFTER_DAYS',
+                                  DEFAULT_ARCHIVE_AFTER_DAYS))
+
+
+def compress(text):
+    return zlib.compress(text.encode(), COMPRESS_LEVEL)
+
+
+def _copy(source, model, **values):
+    values.update((field, getattr(source, field)) for field in COPIED_FIELDS)
+    return model(image=source.image.name, **values)
+
+
+def as_post(archived):
+    """Несохранённая копия архивного поста в виде Post."""
+    return _copy(archived, Post, text=archived.text)
+
+
+def _delete_rows(model, ids):
+    # queryset.delete() удалил бы вместе с постом его комментарии и
+    # разослал сигналы, уменьшающие счётчики.
+    table = connection.ops.quote_name(model._meta.db_table)
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE id IN ({placeholders})', ids)
+
+
+def archive_batch(cutoff, size):
+    """Переносит в архив до size самых старых постов раньше cutoff."""
+    with transaction.atomic():
+        posts = list(Post.objects.filter(
+            pub_date__lt=cutoff).order_by('pub_date', 'id')[:size])
+        if not posts:
+            return 0
+        ids = [post.pk for post in posts]
+        ArchivedPost.objects.bulk_create([
+            _copy(post, ArchivedPost, text_compressed=compress(post.text))
+            for post in posts
+        ])
+        _delete_rows(Post, ids)
+    bump_generation()
+    return len(ids)
+
+
+def restore(post_id):
+    """Возвращает пост из архива в Post; None, если в архиве его нет."""
+    with transaction.atomic():
+        archived = ArchivedPost.objects.select_for_update().filter(
+            pk=post_id).first()
+        if archived is None:
+            return None
+        post = as_post(archived)
+        # Как loaddata: сохраняется pub_date, а сигналы не считают пост
+        # новым.
+        post.save_base(raw=True, force_insert=True)
+        _delete_rows(ArchivedPost, [post_id])
+    return post
+
+
+def find_post(post_id):
+    """Пост по id из Post или из архива; None, если его нет нигде."""
+    for model in (Post, ArchivedPost):
+        post = model.objects.select_related('author', 'group').filter(
+            id=post_id).first()
+        if post is not None:
+            return post
+    return None
+
+
+def hot_post(post_id):
+    """Пост из Post; архивный сначала возвращается из архива."""
+    return Post.objects.filter(id=post_id).first() or restore(post_id)
+
+
+class TieredPaginator(CursorPaginator):
+    """
+    Курсорная выдача по обоим ярусам: с каждого берётся не больше
+    страницы по своему индексу (pub_date, id), и результаты сливаются.
+    """
+
+    def __init__(self, posts, archived, per_page, **kwargs):
+        super().__init__(posts, per_page, keys=POST_KEYS, **kwargs)
+        self.archived = archived
+
+    def fetch(self, values, older, limit):
+        posts = super().fetch(values, older, limit) + keyset_slice(
+            self.archived, self.keys, values, older, limit)
+        posts.sort(key=self.key_values, reverse=True)
+        return posts[:limit] if older else posts[-limit:]
+
+    @cached_property
+    def count(self):
+        return self.object_list.count() + self.archived.count()
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        objects = self.fetch(None, True, top)[bottom:top]
+        return self._get_page(objects, number, self)
+
+
+def paginator(posts, archived, request):
+    return get_page(
+        TieredPaginator(posts, archived, POSTS_ON_PAGE), request)
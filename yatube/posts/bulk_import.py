@@ -0,0 +1,399 @@
+"""
+Потоковый импорт пользователей, групп, постов, комментариев и подписок.
+
+Записи читаются по одной из JSONL или CSV и копятся в буферах по
+моделям. Полный буфер записывается одним bulk_create в своей транзакции,
+так что в памяти не больше пачки на модель. Перед записью пачки
+записываются буферы моделей, от которых она зависит, в порядке MODELS.
+
+Ссылки на пользователей и группы — по username и slug. Посты и
+комментарии получают новые id, а ImportedObject запоминает, какой id
+источника какому объекту соответствует: комментарии находят пост по id
+из файла, а повторный импорт того же источника пропускает уже созданные
+объекты. Комментарий к посту, которого нет в источнике, привязывается к
+посту базы с тем же id и автором post_author, иначе пропускается.
+bulk_create не отправляет сигналы, поэтому счётчики, поисковый индекс и
+ленты подписок обновляются по пачке целиком.
+"""
+import csv
+import json
+import time
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import (UNUSABLE_PASSWORD_PREFIX,
+                                         identify_hasher, make_password)
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Case, F, Max, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import counters, search, timeline
+from .cache import bump_generation
+from .models import (ArchivedPost, Comment, Follow, Group, ImportedObject,
+                     Post)
+
+User = get_user_model()
+
+MODELS = ('user', 'group', 'post', 'comment', 'follow')
+DEFAULT_BATCH_SIZE = 1000
+# Три параметра запроса на строку: SQLite до 3.32 принимает до 999.
+DATES_BATCH_SIZE = 300
+
+
+class RecordError(ValueError):
+    pass
+
+
+def read_jsonl(lines, model=None):
+    """(модель, запись) из строк JSON; модель — поле model или аргумент."""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            raise RecordError(f'строка {number}: {error}')
+        if not isinstance(record, dict):
+            raise RecordError(f'строка {number}: ожидался объект')
+        yield record.pop('model', model), record
+
+
+def read_csv(lines, model=None):
+    """(модель, запись) из CSV с заголовком; пустые ячейки отбрасываются."""
+    for row in csv.DictReader(lines):
+        record = {key: value for key, value in row.items() if value}
+        yield record.pop('model', model), record
+
+
+def _required(record, key):
+    value = record.get(key)
+    if value in (None, ''):
+        raise RecordError(f'нет поля {key}: {record}')
+    return value
+
+
+def _datetime(record, key):
+    value = record.get(key)
+    if not value:
+        return timezone.now()
+    parsed = parse_datetime(str(value))
+    if parsed is None:
+        raise RecordError(f'неверная дата {key}: {value}')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _int(record, key):
+    try:
+        return int(_required(record, key))
+    except (TypeError, ValueError):
+        raise RecordError(f'неверное число {key}: {record.get(key)}')
+
+
+def _password(record):
+    """Хеш пароля из записи; пароли открытым текстом не принимаются."""
+    password = record.get('password')
+    if not password:
+        return make_password(None)
+    if not password.startswith(UNUSABLE_PASSWORD_PREFIX):
+        try:
+            identify_hasher(password)
+        except ValueError:
+            raise RecordError(f'пароль не похож на хеш: {record["username"]}')
+    return password
+
+
+def _record_post(record):
+    try:
+        return int(record.get('post'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _set_dates(model, objects, field_name, dates):
+    """
+    bulk_create ставит в поле с auto_now_add текущее время: даты из файла
+    записываются следом, одним UPDATE на DATES_BATCH_SIZE строк.
+    """
+    field = model._meta.get_field(field_name)
+    for obj, date in zip(objects, dates):
+        setattr(obj, field_name, date)
+    for start in range(0, len(objects), DATES_BATCH_SIZE):
+        batch = objects[start:start + DATES_BATCH_SIZE]
+        model.objects.filter(pk__in=[obj.pk for obj in batch]).update(**{
+            field_name: Case(*[
+                When(pk=obj.pk, then=Value(getattr(obj, field_name)))
+                for obj in batch
+            ], output_field=field)
+        })
+
+
+def _lock_for_write(model):
+    """
+    Берёт блокировку на запись в текущей транзакции, как BEGIN IMMEDIATE:
+    в SQLite её берёт любой UPDATE, даже не задевший ни одной строки.
+    """
+    model.objects.filter(id__lt=0).update(id=F('id'))
+
+
+class Importer:
+    def __init__(self, source, batch_size=DEFAULT_BATCH_SIZE, on_batch=None,
+                 on_error=None):
+        self.source = source
+        self.batch_size = batch_size
+        self.on_batch = on_batch
+        self.on_error = on_error
+        self.buffers = {model: [] for model in MODELS}
+        # written, existing, skipped
+        self.stats = Counter()
+        # Модели, которым id назначал импорт, а не база.
+        self.created = set()
+        self.started = time.monotonic()
+
+    @property
+    def rows_per_second(self):
+        elapsed = time.monotonic() - self.started
+        return self.stats['written'] / elapsed if elapsed else 0.0
+
+    def add(self, model, record):
+        if model not in self.buffers:
+            self._skip(RecordError(f'неизвестная модель {model}: {record}'))
+            return
+        buffer = self.buffers[model]
+        buffer.append(record)
+        if len(buffer) >= self.batch_size:
+            self.flush(model)
+
+    def run(self, records):
+        for model, record in records:
+            self.add(model, record)
+        self.finish()
+        return self.stats
+
+    def flush(self, model):
+        """Записывает буфер модели и буферы всех моделей до неё."""
+        for name in MODELS[:MODELS.index(model) + 1]:
+            batch = self.buffers[name]
+            if not batch:
+                continue
+            self.buffers[name] = []
+            with transaction.atomic():
+                getattr(self, f'_write_{name}s')(batch)
+            if self.on_batch:
+                self.on_batch(self)
+
+    def finish(self):
+        self.flush(MODELS[-1])
+        if self.created:
+            # Как loaddata: последовательности id догоняют записанные id.
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(
+                        no_style(), list(self.created)):
+                    cursor.execute(sql)
+        bump_generation()
+
+    def _skip(self, error):
+        self.stats['skipped'] += 1
+        if self.on_error:
+            self.on_error(error)
+
+    def _build(self, records, make):
+        objects = []
+        for record in records:
+            try:
+                objects.append(make(record))
+            except RecordError as error:
+                self._skip(error)
+        return objects
+
+    def _new(self, objects, key, existing):
+        """Убирает уже существующие объекты и повторы внутри пачки."""
+        new = {}
+        for obj in objects:
+            if key(obj) in existing or key(obj) in new:
+                self.stats['existing'] += 1
+            else:
+                new[key(obj)] = obj
+        self.stats['written'] += len(new)
+        return list(new.values())
+
+    def _mapping(self, model, source_ids):
+        """{id источника: id объекта} для уже импортированных записей."""
+        return dict(ImportedObject.objects.filter(
+            source=self.source, model=model, source_id__in=source_ids,
+        ).values_list('source_id', 'object_id'))
+
+    def _create(self, model, name, pairs, *shared):
+        """
+        Пишет объекты из пар (id источника, объект) и запоминает их id.
+        Если bulk_create возвращает id, их назначает база. Иначе id
+        назначаются после наибольшего id модели и моделей shared с общими
+        id, но только когда транзакция уже держит блокировку на запись:
+        до фиксации никто не займёт те же id.
+        """
+        objects = [obj for _, obj in pairs]
+        if connection.features.can_return_ids_from_bulk_insert:
+            model.objects.bulk_create(objects)
+        else:
+            _lock_for_write(model)
+            next_id = 1 + max(
+                other.objects.aggregate(top=Max('id'))['top'] or 0
+                for other in (model, *shared))
+            for number, obj in enumerate(objects):
+                obj.id = next_id + number
+            model.objects.bulk_create(objects)
+            self.created.add(model)
+        ImportedObject.objects.bulk_create([
+            ImportedObject(source=self.source, model=name,
+                           source_id=source_id, object_id=obj.id)
+            for source_id, obj in pairs
+        ])
+        return objects
+
+    def _user_ids(self, records, *keys):
+        names = {record.get(key) for record in records for key in keys}
+        return dict(User.objects.filter(
+            username__in=names).values_list('username', 'id'))
+
+    def _user_id(self, user_ids, record, key):
+        username = _required(record, key)
+        if username not in user_ids:
+            raise RecordError(f'нет пользователя {username}: {record}')
+        return user_ids[username]
+
+    def _write_users(self, records):
+        users = self._build(records, lambda record: User(
+            username=_required(record, 'username'),
+            email=record.get('email') or '',
+            first_name=record.get('first_name') or '',
+            last_name=record.get('last_name') or '',
+            password=_password(record),
+            date_joined=_datetime(record, 'date_joined'),
+        ))
+        existing = set(User.objects.filter(
+            username__in=[user.username for user in users]
+        ).values_list('username', flat=True))
+        User.objects.bulk_create(
+            self._new(users, lambda user: user.username, existing))
+
+    def _write_groups(self, records):
+        groups = self._build(records, lambda record: Group(
+            slug=_required(record, 'slug'),
+            title=_required(record, 'title'),
+            description=record.get('description') or '',
+        ))
+        existing = set(Group.objects.filter(
+            slug__in=[group.slug for group in groups]
+        ).values_list('slug', flat=True))
+        Group.objects.bulk_create(
+            self._new(groups, lambda group: group.slug, existing))
+
+    def _write_posts(self, records):
+        user_ids = self._user_ids(records, 'author')
+        group_ids = dict(Group.objects.filter(
+            slug__in={record.get('group') for record in records}
+        ).values_list('slug', 'id'))
+
+        def make(record):
+            slug = record.get('group')
+            if slug and slug not in group_ids:
+                raise RecordError(f'нет группы {slug}: {record}')
+            return _int(record, 'id'), Post(
+                text=_required(record, 'text'),
+                author_id=self._user_id(user_ids, record, 'author'),
+                group_id=group_ids.get(slug),
+                pub_date=_datetime(record, 'pub_date'),
+            )
+
+        pairs = self._build(records, make)
+        existing = self._mapping(
+            'post', [source_id for source_id, _ in pairs])
+        pairs = self._new(pairs, lambda pair: pair[0], existing)
+        dates = [post.pub_date for _, post in pairs]
+        posts = self._create(Post, 'post', pairs, ArchivedPost)
+        _set_dates(Post, posts, 'pub_date', dates)
+        search.index_new_posts(posts)
+        counters.recount_users({post.author_id for post in posts})
+        timeline.push_posts(posts)
+
+    def _existing_posts(self, records, mapped):
+        """
+        {id: id} постов, которых нет в источнике: комментарий к чужому
+        посту находит его в базе по тому же id и имени автора.
+        """
+        wanted = {
+            (_record_post(record), record.get('post_author'))
+            for record in records
+            if record.get('post_author')
+            and _record_post(record) not in mapped
+        }
+        found = {}
+        for model in (Post, ArchivedPost):
+            found.update(
+                (post_id, post_id)
+                for post_id, username in model.objects.filter(
+                    pk__in={post_id for post_id, _ in wanted},
+                ).values_list('pk', 'author__username')
+                if (post_id, username) in wanted)
+        return found
+
+    def _write_comments(self, records):
+        user_ids = self._user_ids(records, 'author')
+        post_ids = self._mapping(
+            'post', {_record_post(record) for record in records})
+        post_ids.update(self._existing_posts(records, post_ids))
+        known = set(Post.objects.filter(
+            pk__in=post_ids.values()).values_list('pk', flat=True)).union(
+            ArchivedPost.objects.filter(
+                pk__in=post_ids.values()).values_list('pk', flat=True))
+
+        def make(record):
+            source_post = _int(record, 'post')
+            post_id = post_ids.get(source_post)
+            if post_id not in known:
+                raise RecordError(f'нет поста {source_post}: {record}')
+            return _int(record, 'id'), Comment(
+                post_id=post_id,
+                author_id=self._user_id(user_ids, record, 'author'),
+                text=_required(record, 'text'),
+                created=_datetime(record, 'created'),
+            )
+
+        pairs = self._build(records, make)
+        existing = self._mapping(
+            'comment', [source_id for source_id, _ in pairs])
+        pairs = self._new(pairs, lambda pair: pair[0], existing)
+        dates = [comment.created for _, comment in pairs]
+        comments = self._create(Comment, 'comment', pairs)
+        _set_dates(Comment, comments, 'created', dates)
+        counters.recount_posts({comment.post_id for comment in comments})
+
+    def _write_follows(self, records):
+        user_ids = self._user_ids(records, 'user', 'author')
+
+        def make(record):
+            follow = Follow(
+                user_id=self._user_id(user_ids, record, 'user'),
+                author_id=self._user_id(user_ids, record, 'author'),
+            )
+            if follow.user_id == follow.author_id:
+                raise RecordError(f'подписка на себя: {record}')
+            return follow
+
+        follows = self._build(records, make)
+        existing = set(Follow.objects.filter(
+            user_id__in={follow.user_id for follow in follows},
+            author_id__in={follow.author_id for follow in follows},
+        ).values_list('user_id', 'author_id'))
+        follows = self._new(
+            follows, lambda follow: (follow.user_id, follow.author_id),
+            existing)
+        Follow.objects.bulk_create(follows)
+        counters.recount_users(
+            {follow.user_id for follow in follows}
+            | {follow.author_id for follow in follows})
+        timeline.add_follows(
+            (follow.user_id, follow.author_id) for follow in follows)
@@ -0,0 +1,178 @@
+"""
+Версионированный кэш страниц.
+
+Каждое изменение постов, групп и пользователей увеличивает счётчик
+поколения, а закэшированная страница помнит, при каком поколении она
+собрана. Поэтому страницы можно хранить долго: после правки данных
+следующий запрос увидит, что копия относится к старому поколению.
+Счётчик, как и версии карточек постов, лежит в базе (CacheVersion): у
+каждого процесса своя копия страниц и карточек в локальном кэше, но
+правку, сделанную в одном процессе, видят все.
+
+Пересчёт защищён от лавины промахов: страницу пересобирает только запрос,
+захвативший блокировку, остальные в это время получают прежнюю копию.
+Кроме того, копия может быть пересчитана заранее, до истечения срока, с
+вероятностью, растущей к его концу (probabilistic early expiration).
+"""
+import hashlib
+import math
+import random
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, router
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils.cache import (get_cache_key, has_vary_header,
+                                learn_cache_key, patch_vary_headers)
+
+from .models import CacheVersion
+
+GENERATION_KEY = 'posts:generation'
+# Сколько секунд блокировка пересчёта живёт, если воркер упал.
+LOCK_TIMEOUT = 30
+# Сколько секунд устаревшая копия хранится после истечения срока,
+# чтобы её можно было отдать, пока страница пересчитывается.
+STALE_TIMEOUT = 60 * 60 * 24
+EARLY_REFRESH_BETA = 1.0
+
+
+def _fresh_generation():
+    # Новое значение не должно совпасть ни с одним из прежних, в том числе
+    # выданных в откаченной транзакции, иначе оживут устаревшие страницы.
+    return time.time_ns()
+
+
+def _bump(key):
+    versions = CacheVersion.objects.filter(key=key)
+    value = Greatest(F('value') + 1, Value(_fresh_generation()))
+    if not versions.update(value=value):
+        CacheVersion.objects.get_or_create(
+            key=key, defaults={'value': _fresh_generation()})
+        versions.update(value=value)
+
+
+def _stored(keys, using=None):
+    """
+    Значения счётчиков из базы using (по умолчанию — той, из которой
+    читает запрос). Недостающие счётчики заводятся в default, а в
+    реплике считаются равными None.
+    """
+    using = using or router.db_for_read(CacheVersion)
+    values = dict(CacheVersion.objects.using(using).filter(
+        key__in=keys).values_list('key', 'value'))
+    missing = [key for key in keys if key not in values]
+    if missing and using == DEFAULT_DB_ALIAS:
+        CacheVersion.objects.bulk_create(
+            [CacheVersion(key=key, value=_fresh_generation())
+             for key in missing],
+            ignore_conflicts=True)
+        values.update(CacheVersion.objects.filter(
+            key__in=missing).values_list('key', 'value'))
+    return {key: values.get(key) for key in keys}
+
+
+def generation(using=None):
+    return _stored([GENERATION_KEY], using)[GENERATION_KEY]
+
+
+def bump_generation():
+    _bump(GENERATION_KEY)
+
+
+def _version_key(kind, pk):
+    return f'posts:version.{kind}.{pk}'
+
+
+def bump_version(kind, pk):
+    """Сбрасывает закэшированные карточки, зависящие от объекта."""
+    _bump(_version_key(kind, pk))
+
+
+def card_version(post):
+    """
+    Отметка версии карточки поста: меняется при правке поста, его автора
+    или группы, а также при смене автора или группы у поста.
+    """
+    parts = (('post', post.pk), ('user', post.author_id),
+             ('group', post.group_id))
+    versions = _stored([_version_key(kind, pk) for kind, pk in parts])
+    return '.'.join(
+        f'{pk}:{version}'
+        for (_, pk), version in zip(parts, versions.values()))
+
+
+def _should_cache(request, response):
+    if response.streaming or response.status_code != 200:
+        return False
+    if (not request.COOKIES and response.cookies
+            and has_vary_header(response, 'Cookie')):
+        return False
+    return 'private' not in response.get('Cache-Control', ())
+
+
+def _is_fresh(entry, current_generation, beta):
+    if entry['generation'] != current_generation:
+        return False
+    # XFetch: чем дольше пересчёт и ближе срок, тем вероятнее пересчёт
+    # заранее одним из запросов.
+    early = entry['delta'] * beta * math.log(1.0 - random.random())
+    return time.time() - early < entry['expires']
+
+
+def _lock_key(request, cache_key):
+    source = cache_key or request.build_absolute_uri()
+    return 'posts:lock.' + hashlib.md5(source.encode()).hexdigest()
+
+
+def _acquire_lock(lock_key):
+    return cache.add(lock_key, True, LOCK_TIMEOUT)
+
+
+def versioned_cache_page(timeout, key_prefix, beta=EARLY_REFRESH_BETA):
+    """
+    Аналог cache_page с ключом, зависящим от поколения данных, и защитой
+    от одновременного пересчёта. Страница различается по Cookie, чтобы
+    шапка одного пользователя не попадала другому.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+            current = generation(DEFAULT_DB_ALIAS)
+            cache_key = get_cache_key(
+                request, key_prefix, 'GET', cache=cache)
+            entry = cache.get(cache_key) if cache_key else None
+            if entry is not None and _is_fresh(entry, current, beta):
+                return entry['response']
+            lock_key = _lock_key(request, cache_key)
+            locked = _acquire_lock(lock_key)
+            if not locked and entry is not None:
+                return entry['response']
+            # Страница из отстающей реплики получает поколение реплики и
+            # не будет считаться свежей, пока та не догонит default.
+            using = router.db_for_read(CacheVersion)
+            built = current if using == DEFAULT_DB_ALIAS else generation(using)
+            try:
+                started = time.monotonic()
+                response = view_func(request, *args, **kwargs)
+                delta = time.monotonic() - started
+                if _should_cache(request, response):
+                    patch_vary_headers(response, ('Cookie',))
+                    cache_key = learn_cache_key(
+                        request, response, timeout + STALE_TIMEOUT,
+                        key_prefix, cache=cache)
+                    cache.set(cache_key, {
+                        'response': response,
+                        'generation': built,
+                        'expires': time.time() + timeout,
+                        'delta': delta,
+                    }, timeout + STALE_TIMEOUT)
+            finally:
+                if locked:
+                    cache.delete(lock_key)
+            return response
+        return wrapper
+    return decorator
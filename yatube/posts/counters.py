@@ -0,0 +1,68 @@
+"""
+Денормализованные счётчики: посты, подписчики и подписки пользователя,
+комментарии поста. Поддерживаются сигналами в той же транзакции, что и
+изменение данных; recount_users() и recount_posts() пересчитывают их
+заново.
+"""
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import ArchivedPost, Comment, Follow, Post, UserCounters
+
+
+def get_counters(user_id):
+    """Счётчики пользователя; для нового пользователя — нулевые."""
+    counters = UserCounters.objects.filter(user_id=user_id).first()
+    return counters or UserCounters(user_id=user_id)
+
+
+def change(user_id, field, delta):
+    if user_id is None:
+        return
+    counters = UserCounters.objects.filter(user_id=user_id)
+    if delta < 0:
+        counters.filter(**{f'{field}__gte': -delta}).update(
+            **{field: F(field) + delta})
+        return
+    if not counters.update(**{field: F(field) + delta}):
+        UserCounters.objects.get_or_create(user_id=user_id)
+        counters.update(**{field: F(field) + delta})
+
+
+def change_comments(post_id, delta):
+    # Пост может лежать в любом из ярусов: id у них общие.
+    for model in (Post, ArchivedPost):
+        posts = model.objects.filter(pk=post_id)
+        if delta < 0:
+            posts = posts.filter(comments_count__gte=-delta)
+        if posts.update(comments_count=F('comments_count') + delta):
+            return
+
+
+def _count(queryset, field):
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')})
+        .order_by().values(field).annotate(total=Count('*'))
+        .values('total')
+    ), 0)
+
+
+def recount_users(user_ids):
+    """Пересчитывает счётчики заданных пользователей."""
+    UserCounters.objects.bulk_create(
+        [UserCounters(user_id=user_id) for user_id in user_ids],
+        ignore_conflicts=True,
+    )
+    UserCounters.objects.filter(user_id__in=user_ids).update(
+        posts=(_count(Post.objects.all(), 'author')
+               + _count(ArchivedPost.objects.all(), 'author')),
+        followers=_count(Follow.objects.all(), 'author'),
+        following=_count(Follow.objects.all(), 'user'),
+    )
+
+
+def recount_posts(post_ids):
+    """Пересчитывает число комментариев заданных постов обоих ярусов."""
+    for model in (Post, ArchivedPost):
+        model.objects.filter(pk__in=post_ids).update(
+            comments_count=_count(Comment.objects.all(), 'post'))
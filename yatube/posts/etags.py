@@ -0,0 +1,79 @@
+"""
+Валидаторы для условных GET-запросов.
+
+ETag собирается из уже имеющихся данных: дат публикации, счётчиков,
+версий карточек и поколения кэша страниц, а у страницы поста — ещё и из
+CSRF-токена её формы. Last-Modified не отдаётся:
+дата последнего поста не меняется при правке или удалении старых постов.
+"""
+import hashlib
+
+from django.contrib.auth import get_user_model
+from django.db.models import Max
+from django.middleware.csrf import get_token
+
+from .cache import card_version, generation
+from .counters import get_counters
+from .models import ArchivedPost, Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+def _etag(*parts):
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def _csrf_token(request):
+    # Форма комментария на странице поста несёт CSRF-токен, а Django
+    # меняет его при входе: копия со старым токеном не должна оживать.
+    if not request.user.is_authenticated:
+        return None
+    # Без cookie get_token заводит токен, который и попадёт в страницу.
+    get_token(request)
+    return request.META['CSRF_COOKIE']
+
+
+def _latest_pub_date(queryset):
+    return queryset.order_by('-pub_date', '-id').values_list(
+        'pub_date', flat=True).first()
+
+
+def post_detail(request, post_id):
+    for model in (Post, ArchivedPost):
+        post = model.objects.filter(id=post_id).only(
+            'pub_date', 'comments_count', 'author', 'group').first()
+        if post is not None:
+            break
+    else:
+        return None
+    latest_comment = Comment.objects.filter(post=post_id).aggregate(
+        latest=Max('created'))['latest']
+    return _etag(
+        post.id, post.pub_date, latest_comment, post.comments_count,
+        card_version(post), get_counters(post.author_id).posts,
+        generation(), request.user.pk, _csrf_token(request),
+    )
+
+
+def profile(request, username):
+    author = User.objects.filter(username=username).first()
+    if author is None:
+        return None
+    counters = get_counters(author.id)
+    following = request.user.is_authenticated and Follow.objects.filter(
+        user=request.user, author=author).exists()
+    return _etag(
+        author.id, _latest_pub_date(Post.objects.filter(author=author)),
+        counters.posts, counters.followers, counters.following, following,
+        generation(), request.user.pk,
+    )
+
+
+def group_posts(request, slug):
+    group = Group.objects.filter(slug=slug).first()
+    if group is None:
+        return None
+    return _etag(
+        group.id, _latest_pub_date(group.posts.all()),
+        generation(), request.user.pk,
+    )
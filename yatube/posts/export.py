@@ -0,0 +1,176 @@
+"""
+Потоковая выгрузка постов и комментариев пользователя.
+
+Строки читаются через iterator(chunk_size) и сразу превращаются в JSONL
+или CSV, а по желанию — в поток zip-архива, так что память не зависит
+от числа постов. Формат записей тот же, что у import_data. Выгрузка
+содержит самого пользователя (без пароля), группы его постов и все его
+комментарии, поэтому загружается и в пустую базу. Комментарий ссылается
+на пост по id и имени автора поста: комментарии к чужим постам
+import_data привязывает к посту с тем же id и автором, если он есть.
+"""
+import csv
+import json
+import zipfile
+
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import ArchivedPost, Comment, Group, Post
+
+FORMATS = {
+    'jsonl': ('.jsonl', 'application/x-ndjson'),
+    'csv': ('.csv', 'text/csv'),
+}
+CSV_FIELDS = ('model', 'id', 'username', 'email', 'first_name', 'last_name',
+              'date_joined', 'slug', 'title', 'description', 'post',
+              'post_author', 'author', 'group', 'text', 'pub_date',
+              'created')
+DEFAULT_CHUNK_SIZE = 2000
+# Столько байт копится перед отправкой, чтобы не писать по строке.
+BUFFER_SIZE = 64 * 1024
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _post_author(model):
+    return Subquery(model.objects.filter(
+        pk=OuterRef('post_id')).values('author__username')[:1])
+
+
+def records(user, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Пользователь, группы его постов, посты из обоих ярусов, затем все его
+    комментарии.
+    """
+    yield {
+        'model': 'user',
+        'username': user.username,
+        'email': user.email,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'date_joined': _iso(user.date_joined),
+    }
+    groups = Group.objects.filter(
+        Q(id__in=Post.objects.filter(author=user).values('group_id'))
+        | Q(id__in=ArchivedPost.objects.filter(
+            author=user).values('group_id'))
+    ).order_by('id')
+    for group in groups.iterator(chunk_size=chunk_size):
+        yield {
+            'model': 'group',
+            'slug': group.slug,
+            'title': group.title,
+            'description': group.description,
+        }
+    for model in (Post, ArchivedPost):
+        posts = model.objects.filter(author=user).select_related(
+            'group').order_by('pub_date', 'id')
+        for post in posts.iterator(chunk_size=chunk_size):
+            yield {
+                'model': 'post',
+                'id': post.id,
+                'author': user.username,
+                'group': post.group.slug if post.group else None,
+                'text': post.text,
+                'pub_date': _iso(post.pub_date),
+            }
+    comments = Comment.objects.filter(author=user).annotate(
+        post_author=Coalesce(_post_author(Post), _post_author(ArchivedPost)),
+    ).order_by('created', 'id')
+    for comment in comments.iterator(chunk_size=chunk_size):
+        yield {
+            'model': 'comment',
+            'id': comment.id,
+            'post': comment.post_id,
+            'post_author': comment.post_author,
+            'author': user.username,
+            'text': comment.text,
+            'created': _iso(comment.created),
+        }
+
+
+def jsonl_lines(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+class _Echo:
+    """Файл для csv.writer, который просто возвращает записанное."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(records):
+    writer = csv.DictWriter(_Echo(), CSV_FIELDS)
+    yield writer.writerow(dict(zip(CSV_FIELDS, CSV_FIELDS)))
+    for record in records:
+        yield writer.writerow(record)
+
+
+LINES = {'jsonl': jsonl_lines, 'csv': csv_lines}
+
+
+def buffered(lines, size=BUFFER_SIZE):
+    """Склеивает строки в куски байт не меньше size."""
+    chunk = []
+    length = 0
+    for line in lines:
+        data = line.encode()
+        chunk.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(chunk)
+            chunk = []
+            length = 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+class _Pipe:
+    """Файл для ZipFile: копит записанное, пока его не заберут."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def zipped(chunks, name):
+    """
+    zip-архив с одним файлом name, собираемый на лету. Поток не
+    перематывается, поэтому размеры пишутся после данных файла.
+    """
+    pipe = _Pipe()
+    with zipfile.ZipFile(pipe, 'w', zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(name, 'w', force_zip64=True) as member:
+            for chunk in chunks:
+                member.write(chunk)
+                data = pipe.take()
+                if data:
+                    yield data
+    yield pipe.take()
+
+
+def stream(user, file_format='jsonl', compress=False,
+           chunk_size=DEFAULT_CHUNK_SIZE):
+    """(куски байт, content type, имя файла) выгрузки пользователя."""
+    extension, content_type = FORMATS[file_format]
+    name = f'{user.username}{extension}'
+    chunks = buffered(LINES[file_format](records(user, chunk_size)))
+    if compress:
+        return zipped(chunks, name), 'application/zip', f'{name}.zip'
+    return chunks, content_type, name
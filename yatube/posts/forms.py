@@ -1,6 +1,10 @@
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
 from django.forms import ModelForm
+from PIL import Image
 
 from .models import Comment, Follow, Post
+from .uploads import normalize
 
 
 class PostForm(ModelForm):
@@ -8,6 +12,17 @@ class PostForm(ModelForm):
         model = Post
         fields = ['text', 'group', 'image']
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if isinstance(image, UploadedFile):
+            try:
+                image = normalize(image)
+            except (OSError, Image.DecompressionBombError):
+                raise ValidationError(
+                    'Не удалось прочитать картинку: файл повреждён '
+                    'или слишком велик.')
+        return image
+
 
 class CommentForm(ModelForm):
     class Meta:
@@ -0,0 +1,69 @@
+"""
+Сведения о картинке поста: размеры, объём в байтах, SHA-256 и крошечная
+копия-заглушка.
+
+Считаются один раз, пока загруженный файл ещё в памяти, и хранятся в
+полях Post, так что страницам и миниатюрам не нужно открывать файл.
+"""
+import base64
+import hashlib
+import io
+
+from django.core.files.images import get_image_dimensions
+from PIL import Image, ImageOps
+
+META_FIELDS = ('image_width', 'image_height', 'image_size', 'image_hash',
+               'image_placeholder')
+# Пропорции карточки поста: картинки в ленте режутся до 960x339.
+CROP_RATIO = 339 / 960
+PLACEHOLDER_WIDTH = 16
+
+
+def digest(file):
+    """(размер, sha256) содержимого файла; позиция возвращается в начало."""
+    sha256 = hashlib.sha256()
+    size = 0
+    file.seek(0)
+    for chunk in file.chunks():
+        sha256.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+    return size, sha256.hexdigest()
+
+
+def describe(file):
+    """(ширина, высота, размер, sha256) для открытого файла картинки."""
+    size, content_hash = digest(file)
+    width, height = get_image_dimensions(file)
+    file.seek(0)
+    return width, height, size, content_hash
+
+
+def placeholder(file):
+    """
+    data:-URI копии картинки шириной PLACEHOLDER_WIDTH в пропорциях
+    карточки. Каждый её пиксель — среднее по своей области оригинала.
+    """
+    size = (PLACEHOLDER_WIDTH, max(1, round(PLACEHOLDER_WIDTH * CROP_RATIO)))
+    file.seek(0)
+    with Image.open(file) as image:
+        # JPEG можно декодировать сразу в уменьшенном виде.
+        image.draft('RGB', (size[0] * 8, size[1] * 8))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        image = ImageOps.fit(image, size, Image.Resampling.BOX)
+        buffer = io.BytesIO()
+        image.save(buffer, 'PNG', optimize=True)
+    file.seek(0)
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()).decode()
+
+
+def fill_meta(post, file):
+    values = describe(file) + (placeholder(file),)
+    for field, value in zip(META_FIELDS, values):
+        setattr(post, field, value)
+
+
+def clear_meta(post):
+    post.image_width = post.image_height = post.image_size = None
+    post.image_hash = post.image_placeholder = ''
@@ -0,0 +1,123 @@
+"""
+Хранилище ключей sorl-thumbnail для нашего развёртывания.
+
+Стандартное cached_db тратит на каждый {% thumbnail %} запрос в кэш и,
+при промахе, в базу, а LocMemCache прогревается в каждом процессе
+заново. Здесь перед локальным файлом SQLite в режиме WAL стоит LRU в
+памяти процесса: готовые миниатюры читаются из словаря, а файл общий для
+всех процессов на машине и переживает перезапуск.
+
+Промахи в LRU не запоминаются: миниатюру может создать другой процесс.
+Удаления из других процессов LRU не видит, поэтому его размер
+ограничен THUMBNAIL_KVSTORE_LRU_SIZE.
+"""
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from sorl.thumbnail.kvstores.base import KVStoreBase
+
+DEFAULT_LRU_SIZE = 10000
+
+# Статистика в рамках процесса: hits (из LRU), file_hits (из файла),
+# misses, lookups, lookup_seconds.
+stats = Counter()
+
+
+def report():
+    """Доли попаданий в LRU и в файл, среднее время поиска в мс."""
+    lookups = stats['lookups'] or 1
+    return {
+        'lookups': stats['lookups'],
+        'hit_rate': stats['hits'] / lookups,
+        'file_hit_rate': stats['file_hits'] / lookups,
+        'avg_ms': stats['lookup_seconds'] * 1000 / lookups,
+    }
+
+
+class LRU:
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is not None:
+                self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.data.pop(key, None)
+
+
+class KVStore(KVStoreBase):
+    def __init__(self):
+        super().__init__()
+        self.filename = settings.THUMBNAIL_KVSTORE_FILE
+        self.lru = LRU(getattr(settings, 'THUMBNAIL_KVSTORE_LRU_SIZE',
+                               DEFAULT_LRU_SIZE))
+        self.local = threading.local()
+
+    @property
+    def db(self):
+        # У каждого потока своё соединение: sqlite3 не делит их между
+        # потоками, а WAL позволяет читать параллельно с записью.
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.filename, timeout=5,
+                                 isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS kvstore '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID')
+            self.local.db = db
+        return db
+
+    def _get_raw(self, key):
+        started = time.perf_counter()
+        value = self.lru.get(key)
+        if value is not None:
+            stats['hits'] += 1
+        else:
+            row = self.db.execute(
+                'SELECT value FROM kvstore WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                stats['file_hits'] += 1
+                value = row[0]
+                self.lru.set(key, value)
+            else:
+                stats['misses'] += 1
+        stats['lookups'] += 1
+        stats['lookup_seconds'] += time.perf_counter() - started
+        return value
+
+    def _set_raw(self, key, value):
+        self.db.execute(
+            'INSERT OR REPLACE INTO kvstore (key, value) VALUES (?, ?)',
+            (key, value))
+        self.lru.set(key, value)
+
+    def _delete_raw(self, *keys):
+        self.db.executemany(
+            'DELETE FROM kvstore WHERE key = ?', [(key,) for key in keys])
+        self.lru.delete(*keys)
+
+    def _find_keys_raw(self, prefix):
+        rows = self.db.execute(
+            'SELECT key FROM kvstore WHERE substr(key, 1, ?) = ?',
+            (len(prefix), prefix))
+        return [key for key, in rows]
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts.archive import archive_after, archive_batch
+
+
+class Command(BaseCommand):
+    help = 'Переносит старые посты в архив со сжатым текстом'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=None,
+            help='Возраст поста для архива; по умолчанию '
+                 'POST_ARCHIVE_AFTER_DAYS')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        age = (archive_after() if options['days'] is None
+               else timedelta(days=options['days']))
+        cutoff = timezone.now() - age
+        archived = 0
+        while True:
+            moved = archive_batch(cutoff, options['batch_size'])
+            if not moved:
+                break
+            archived += moved
+            self.stdout.write(f'Перенесено постов: {archived}')
+        self.stdout.write(self.style.SUCCESS(
+            f'В архиве новых постов: {archived}'))
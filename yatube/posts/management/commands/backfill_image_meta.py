@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from posts.images import META_FIELDS, fill_meta
+from posts.models import Post
+
+
+def missing_meta(size):
+    """Посты с картинкой без сведений о ней, пачками по возрастанию id."""
+    posts = Post.objects.exclude(image='').exclude(image=None).filter(
+        Q(image_hash='') | Q(image_placeholder='')
+    ).only('id', 'image').order_by('pk')
+    last = 0
+    while True:
+        batch = list(posts.filter(pk__gt=last)[:size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1].pk
+
+
+class Command(BaseCommand):
+    help = ('Заполняет размеры, объём, хэш и заглушки картинок '
+            'у старых постов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        filled = failed = 0
+        for batch in missing_meta(options['batch_size']):
+            done = []
+            for post in batch:
+                try:
+                    with post.image.open('rb') as file:
+                        fill_meta(post, file)
+                except (OSError, TypeError) as error:
+                    failed += 1
+                    self.stderr.write(f'{post.image.name}: {error}')
+                    continue
+                done.append(post)
+            Post.objects.bulk_update(done, META_FIELDS)
+            filled += len(done)
+            self.stdout.write(f'Обработано постов: {filled}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Заполнено: {filled}, не удалось прочитать: {failed}'))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from posts.cache import bump_generation
+from posts.models import ArchivedPost, Post
+from posts.thumbnails import build_variants
+
+
+def missing_variants(model, size):
+    """Картинки постов без вариантов, пачками по возрастанию id поста."""
+    posts = model.objects.exclude(image='').exclude(image=None).filter(
+        image_variants='').only('id', 'image').order_by('pk')
+    last = 0
+    while True:
+        batch = list(posts.filter(pk__gt=last)[:size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1].pk
+
+
+class Command(BaseCommand):
+    help = 'Режет варианты картинок для постов, у которых их ещё нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        done = set()
+        built = failed = 0
+        batches = (
+            batch for model in (Post, ArchivedPost)
+            for batch in missing_variants(model, options['batch_size']))
+        for batch in batches:
+            for post in batch:
+                if post.image.name in done:
+                    continue
+                done.add(post.image.name)
+                if build_variants(post.image.name, post.image.storage):
+                    built += 1
+                else:
+                    failed += 1
+                    self.stderr.write(f'{post.image.name}: нет файла')
+            self.stdout.write(f'Обработано картинок: {len(done)}')
+        if built:
+            # Списки сбрасываются один раз на весь прогон.
+            bump_generation()
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово картинок: {built}, без файла: {failed}'))
@@ -0,0 +1,41 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.export import DEFAULT_CHUNK_SIZE, FORMATS, stream
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Потоково выгружает посты и комментарии пользователя'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--output', default='-',
+                            help='Файл или - для stdout')
+        parser.add_argument('--format', choices=FORMATS, default='jsonl')
+        parser.add_argument('--zip', action='store_true')
+        parser.add_argument('--chunk-size', type=int,
+                            default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['username']).first()
+        if user is None:
+            raise CommandError(f'Нет пользователя {options["username"]}')
+        chunks, _, _ = stream(user, options['format'], options['zip'],
+                              options['chunk_size'])
+        if options['output'] == '-':
+            self.write(chunks, sys.stdout.buffer)
+            return
+        with open(options['output'], 'wb') as file:
+            size = self.write(chunks, file)
+        self.stdout.write(self.style.SUCCESS(f'Выгружено байт: {size}'))
+
+    def write(self, chunks, file):
+        size = 0
+        for chunk in chunks:
+            file.write(chunk)
+            size += len(chunk)
+        return size
@@ -0,0 +1,67 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.bulk_import import (DEFAULT_BATCH_SIZE, MODELS, Importer,
+                               RecordError, read_csv, read_jsonl)
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv}
+
+
+class Command(BaseCommand):
+    help = ('Потоково импортирует пользователей, группы, посты, '
+            'комментарии и подписки из JSONL или CSV')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл или - для stdin')
+        parser.add_argument(
+            '--format', choices=READERS,
+            help='По умолчанию — по расширению файла')
+        parser.add_argument(
+            '--model', choices=MODELS,
+            help='Модель записей без поля model')
+        parser.add_argument(
+            '--source',
+            help='Имя источника для повторных импортов; '
+                 'по умолчанию — имя файла')
+        parser.add_argument('--batch-size', type=int,
+                            default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(
+            path)[1].lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError('Укажите --format: jsonl или csv')
+        source = options['source'] or (
+            None if path == '-' else os.path.basename(path))
+        if not source:
+            raise CommandError('Укажите --source для чтения из stdin')
+        importer = Importer(
+            source,
+            options['batch_size'],
+            on_batch=self.report,
+            on_error=lambda error: self.stderr.write(str(error)),
+        )
+        if path == '-':
+            file = sys.stdin
+        else:
+            file = open(path, encoding='utf-8', newline='')
+        try:
+            stats = importer.run(
+                READERS[file_format](file, options['model']))
+        except RecordError as error:
+            raise CommandError(error)
+        finally:
+            if file is not sys.stdin:
+                file.close()
+        self.stdout.write(self.style.SUCCESS(
+            f'Записано: {stats["written"]}, уже были: {stats["existing"]}, '
+            f'пропущено: {stats["skipped"]}, '
+            f'{importer.rows_per_second:.0f} строк/с'))
+
+    def report(self, importer):
+        self.stdout.write(
+            f'Записано строк: {importer.stats["written"]}, '
+            f'{importer.rows_per_second:.0f} строк/с')
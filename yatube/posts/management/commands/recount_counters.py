@@ -0,0 +1,41 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.counters import recount_posts, recount_users
+from posts.models import Post
+
+User = get_user_model()
+
+
+def batches(queryset, size):
+    ids = queryset.order_by('pk').values_list('pk', flat=True)
+    batch = []
+    for pk in ids.iterator(chunk_size=size):
+        batch.append(pk)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики постов, подписок и комментариев'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        size = options['batch_size']
+        users = posts = 0
+        for user_ids in batches(User.objects.all(), size):
+            with transaction.atomic():
+                recount_users(user_ids)
+            users += len(user_ids)
+        for post_ids in batches(Post.objects.all(), size):
+            with transaction.atomic():
+                recount_posts(post_ids)
+            posts += len(post_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано: пользователей {users}, постов {posts}'))
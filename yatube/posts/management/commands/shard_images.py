@@ -0,0 +1,89 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from posts import thumbnails
+from posts.cache import bump_generation, bump_version
+from posts.models import ArchivedPost, Post
+from posts.storage import SHARDED_NAME
+
+
+def unsharded(model, size):
+    """Посты с картинкой вне дерева по хэшу, пачками по возрастанию id."""
+    posts = model.objects.exclude(image='').exclude(image=None).exclude(
+        image__regex=SHARDED_NAME).only('id', 'image').order_by('pk')
+    last = 0
+    while True:
+        batch = list(posts.filter(pk__gt=last)[:size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1].pk
+
+
+def referenced(name):
+    return any(model.objects.filter(image=name).exists()
+               for model in (Post, ArchivedPost))
+
+
+class Command(BaseCommand):
+    help = ('Переносит картинки постов в дерево каталогов по хэшу '
+            'содержимого и обновляет пути в базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--keep-old', action='store_true',
+            help='Не удалять файлы по старым путям')
+
+    def handle(self, *args, **options):
+        storage = Post._meta.get_field('image').storage
+        moved = failed = 0
+        batches = (
+            batch for model in (Post, ArchivedPost)
+            for batch in unsharded(model, options['batch_size']))
+        for batch in batches:
+            moves = {}
+            for post in batch:
+                old = post.image.name
+                if old in moves:
+                    continue
+                # Сначала копия: пока пути в базе старые, страницы
+                # по-прежнему отдают старый файл.
+                try:
+                    with storage.open(old) as file:
+                        moves[old] = storage.save(old, file)
+                except OSError as error:
+                    failed += 1
+                    self.stderr.write(f'{old}: {error}')
+            moved += self.switch(storage, moves)
+            if not options['keep_old']:
+                self.cleanup(storage, moves)
+            self.stdout.write(f'Перенесено постов: {moved}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено: {moved}, не удалось прочитать: {failed}'))
+
+    def switch(self, storage, moves):
+        # Варианты старого файла удалит cleanup, поэтому они сбрасываются
+        # и режутся заново уже для нового пути.
+        post_ids = []
+        with transaction.atomic():
+            for old, new in moves.items():
+                for model in (Post, ArchivedPost):
+                    posts = model.objects.filter(image=old)
+                    post_ids += posts.values_list('id', flat=True)
+                    posts.update(image=new, image_variants='')
+                thumbnails.schedule_on_commit(new, storage)
+        for post_id in post_ids:
+            bump_version('post', post_id)
+        bump_generation()
+        return len(post_ids)
+
+    def cleanup(self, storage, moves):
+        for old, new in moves.items():
+            # Старый путь мог снова попасть в базу, пока шёл перенос.
+            if old == new or referenced(old):
+                continue
+            default.kvstore.delete(ImageFile(old, storage))
+            storage.delete(old)
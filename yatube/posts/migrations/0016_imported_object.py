@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 20:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_timeline_entry_archived'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportedObject',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255, verbose_name='Источник')),
+                ('model', models.CharField(max_length=20, verbose_name='Модель')),
+                ('source_id', models.BigIntegerField(verbose_name='Id в источнике')),
+                ('object_id', models.PositiveIntegerField(verbose_name='Id объекта')),
+            ],
+            options={
+                'verbose_name': 'Импортированный объект',
+                'verbose_name_plural': 'Импортированные объекты',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='importedobject',
+            constraint=models.UniqueConstraint(fields=('source', 'model', 'source_id'), name='imported_object_source'),
+        ),
+    ]
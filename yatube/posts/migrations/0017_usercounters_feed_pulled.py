@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 21:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_pulled(apps, schema_editor):
+    # Раньше режим определялся числом подписчиков на лету.
+    UserCounters = apps.get_model('posts', 'UserCounters')
+    UserCounters.objects.filter(
+        followers__gte=getattr(settings, 'FEED_FANOUT_THRESHOLD', 10000),
+    ).update(feed_pulled=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_imported_object'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercounters',
+            name='feed_pulled',
+            field=models.BooleanField(default=False, verbose_name='Подтягивается в ленты'),
+        ),
+        migrations.RunPython(mark_pulled, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,10 @@
+import zlib
+
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.utils.functional import cached_property
+
+from .storage import ContentAddressedStorage
 
 PREVIEW_LEN = 15
 
@@ -47,24 +52,140 @@ class Post(models.Model):
         'Картинка',
         help_text='Картинка к посту',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
+        blank=True,
+        null=True,
+    )
+    # Заполняются при загрузке картинки, чтобы вёрстке и миниатюрам не
+    # приходилось открывать файл.
+    image_width = models.PositiveIntegerField(
+        'Ширина картинки',
+        blank=True,
+        null=True,
+        editable=False,
+    )
+    image_height = models.PositiveIntegerField(
+        'Высота картинки',
+        blank=True,
+        null=True,
+        editable=False,
+    )
+    image_size = models.PositiveIntegerField(
+        'Размер картинки в байтах',
         blank=True,
         null=True,
+        editable=False,
+    )
+    image_hash = models.CharField(
+        'SHA-256 картинки',
+        max_length=64,
+        blank=True,
+        editable=False,
+    )
+    image_placeholder = models.TextField(
+        'Заглушка картинки',
+        blank=True,
+        editable=False,
+    )
+    # JSON {формат: [[ширина, url], ...]} с готовыми вариантами картинки.
+    image_variants = models.TextField(
+        'Варианты картинки',
+        blank=True,
+        editable=False,
+    )
+    comments_count = models.PositiveIntegerField(
+        'Комментариев',
+        default=0,
+        editable=False,
     )
 
     class Meta:
         ordering = ('-pub_date',)
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date_idx'),
+        ]
+
+    def __str__(self):
+        return self.text[:PREVIEW_LEN]
+
+
+class ArchivedPost(models.Model):
+    """
+    Старый пост в архиве: тот же id, текст сжат zlib. Комментарии
+    остаются в своей таблице и ссылаются на тот же id.
+    """
+    id = models.PositiveIntegerField(primary_key=True)
+    text_compressed = models.BinaryField('Сжатый текст поста')
+    pub_date = models.DateTimeField('Дата публикации')
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='archived_posts',
+        verbose_name='Автор'
+    )
+    group = models.ForeignKey(
+        Group,
+        on_delete=models.SET_NULL,
+        related_name='archived_posts',
+        blank=True,
+        null=True,
+        verbose_name='Группа'
+    )
+    image = models.ImageField(
+        'Картинка',
+        upload_to='posts/',
+        storage=ContentAddressedStorage(),
+        blank=True,
+        null=True,
+    )
+    image_width = models.PositiveIntegerField(
+        'Ширина картинки', blank=True, null=True)
+    image_height = models.PositiveIntegerField(
+        'Высота картинки', blank=True, null=True)
+    image_size = models.PositiveIntegerField(
+        'Размер картинки в байтах', blank=True, null=True)
+    image_hash = models.CharField(
+        'SHA-256 картинки', max_length=64, blank=True)
+    image_placeholder = models.TextField('Заглушка картинки', blank=True)
+    image_variants = models.TextField('Варианты картинки', blank=True)
+    comments_count = models.PositiveIntegerField('Комментариев', default=0)
+
+    class Meta:
+        ordering = ('-pub_date',)
+        verbose_name = 'Архивный пост'
+        verbose_name_plural = 'Архивные посты'
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='archived_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='archived_author_pub_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='archived_group_pub_date_idx'),
+        ]
+
+    @cached_property
+    def text(self):
+        return zlib.decompress(self.text_compressed).decode()
 
     def __str__(self):
         return self.text[:PREVIEW_LEN]
 
 
 class Comment(models.Model):
+    # Без ограничения в базе: комментарии архивного поста ссылаются на
+    # id, которого уже нет в posts_post.
     post = models.ForeignKey(
         Post,
         on_delete=models.CASCADE,
         related_name='comments',
+        db_constraint=False,
     )
     author = models.ForeignKey(
         User,
@@ -85,6 +206,10 @@ class Comment(models.Model):
         ordering = ('-created',)
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
+        indexes = [
+            models.Index(fields=['post', '-created', '-id'],
+                         name='comment_post_created_idx'),
+        ]
 
     def __str__(self):
         return self.text
@@ -109,3 +234,85 @@ class Follow(models.Model):
             models.UniqueConstraint(fields=['user', 'author'],
                                     name='follower_author')
         ]
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='follow_author_user_idx'),
+        ]
+
+
+class UserCounters(models.Model):
+    """Денормализованные счётчики пользователя."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='counters',
+    )
+    posts = models.PositiveIntegerField('Постов', default=0)
+    followers = models.PositiveIntegerField('Подписчиков', default=0)
+    following = models.PositiveIntegerField('Подписок', default=0)
+    # Посты автора не раскладываются в ленты, а подтягиваются при чтении.
+    feed_pulled = models.BooleanField('Подтягивается в ленты', default=False)
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
+
+
+class TimelineEntry(models.Model):
+    """Материализованная лента подписок: строка на пару читатель-пост."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+    )
+    # Без ограничения в базе: запись остаётся, когда пост уходит в архив.
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name='timeline_entries',
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        ordering = ('-pub_date', '-post')
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'],
+                                    name='timeline_user_post')
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_feed_idx')
+        ]
+
+
+class ImportedObject(models.Model):
+    """Объект, созданный import_data для записи с данным id источника."""
+    source = models.CharField('Источник', max_length=255)
+    model = models.CharField('Модель', max_length=20)
+    source_id = models.BigIntegerField('Id в источнике')
+    object_id = models.PositiveIntegerField('Id объекта')
+
+    class Meta:
+        verbose_name = 'Импортированный объект'
+        verbose_name_plural = 'Импортированные объекты'
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'model', 'source_id'],
+                                    name='imported_object_source')
+        ]
+
+
+class CacheVersion(models.Model):
+    """
+    Счётчик версии кэша: поколение страниц или версия карточек объекта.
+    Лежит в базе, чтобы правку в одном процессе видели все остальные.
+    """
+    key = models.CharField('Ключ', max_length=100, primary_key=True)
+    value = models.BigIntegerField('Значение')
+
+    class Meta:
+        verbose_name = 'Версия кэша'
+        verbose_name_plural = 'Версии кэша'
@@ -1,9 +1,147 @@
-from django.core.paginator import Paginator
+import base64
+import binascii
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
 
 POSTS_ON_PAGE = 10
+POST_KEYS = ('pub_date', 'id')
+COMMENTS_ON_PAGE = 20
+COMMENT_KEYS = ('created', 'id')
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(direction, values) -> str:
+    """Упаковывает направление и значения ключа в непрозрачный токен."""
+    payload = [direction] + [
+        value.isoformat() if hasattr(value, 'isoformat') else value
+        for value in values
+    ]
+    token = base64.urlsafe_b64encode(json.dumps(payload).encode())
+    return token.decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Возвращает (направление, сырые значения) или None для мусора."""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, binascii.Error):
+        return None
+    if (not isinstance(payload, list) or len(payload) < 2
+            or payload[0] not in (NEXT, PREVIOUS)):
+        return None
+    return payload[0], payload[1:]
+
+
+def keyset_filter(keys, values, older=True):
+    """
+    Условие «строго после курсора» для сортировки по убыванию keys:
+    (k1 < v1) OR (k1 = v1 AND k2 < v2) OR ...
+    """
+    lookup = 'lt' if older else 'gt'
+    condition = Q()
+    for index, key in enumerate(keys):
+        branch = Q(**{f'{key}__{lookup}': values[index]})
+        for prev_key, prev_value in zip(keys[:index], values[:index]):
+            branch &= Q(**{prev_key: prev_value})
+        condition |= branch
+    return condition
+
+
+def keyset_slice(queryset, keys, values, older, limit):
+    """
+    limit ближайших к курсору объектов в порядке ленты (по убыванию keys).
+    Без курсора отдаёт начало ленты.
+    """
+    queryset = queryset.order_by(*(f'-{key}' for key in keys))
+    if values is not None:
+        queryset = queryset.filter(keyset_filter(keys, values, older))
+    if older:
+        return list(queryset[:limit])
+    return list(queryset.order_by(*keys)[:limit])[::-1]
 
 
-def paginator(post_list, request):
-    paginator = Paginator(post_list, POSTS_ON_PAGE)
+class CursorPaginator(Paginator):
+    """
+    Постраничный вывод по ключу (pub_date, id) без OFFSET и COUNT(*).
+    Номерные страницы get_page() по-прежнему работают поверх того же
+    упорядоченного queryset.
+    """
+
+    def __init__(self, object_list, per_page, keys=POST_KEYS, **kwargs):
+        self.keys = tuple(keys)
+        object_list = object_list.order_by(
+            *(f'-{key}' for key in self.keys))
+        super().__init__(object_list, per_page, **kwargs)
+
+    def key_values(self, obj):
+        return [getattr(obj, key) for key in self.keys]
+
+    def parse_cursor(self, token):
+        cursor = decode_cursor(token)
+        if cursor is None:
+            return None
+        direction, raw_values = cursor
+        if len(raw_values) != len(self.keys):
+            return None
+        opts = self.object_list.model._meta
+        try:
+            values = [
+                opts.get_field(key).to_python(raw)
+                for key, raw in zip(self.keys, raw_values)
+            ]
+        except (FieldDoesNotExist, ValidationError):
+            return None
+        if None in values:
+            return None
+        return direction, values
+
+    def fetch(self, values, older, limit):
+        return keyset_slice(self.object_list, self.keys, values, older, limit)
+
+    def cursor_page(self, token):
+        """Страница по токену ?cursor=; битый токен даёт первую страницу."""
+        cursor = self.parse_cursor(token)
+        if cursor is None:
+            direction, values = NEXT, None
+        else:
+            direction, values = cursor
+        older = direction == NEXT
+        objects = self.fetch(values, older, self.per_page + 1)
+        has_more = len(objects) > self.per_page
+        if older:
+            objects = objects[:self.per_page]
+            has_next, has_previous = has_more, values is not None
+        else:
+            objects = objects[-self.per_page:]
+            has_next, has_previous = True, has_more
+        page = Page(objects, 1, self)
+        page.is_cursor = True
+        page.next_cursor = (
+            encode_cursor(NEXT, self.key_values(objects[-1]))
+            if has_next and objects else None)
+        page.previous_cursor = (
+            encode_cursor(PREVIOUS, self.key_values(objects[0]))
+            if has_previous and objects else None)
+        return page
+
+
+def get_page(paginator, request):
+    """Курсорная страница; старые ссылки ?page=N открывают номерную."""
+    cursor = request.GET.get('cursor')
     page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+    if page_number is not None and cursor is None:
+        return paginator.get_page(page_number)
+    return paginator.cursor_page(cursor)
+
+
+def paginator(post_list, request, keys=POST_KEYS):
+    return get_page(
+        CursorPaginator(post_list, POSTS_ON_PAGE, keys=keys), request)
@@ -0,0 +1,275 @@
+"""
+Картинки нужного размера по подписанной ссылке.
+
+Шаблон только строит ссылку resize_url(): размеры, обрезка и формат
+подписываются, поэтому поменять их в адресе нельзя. Картинку режет
+представление image_resize при первом запросе и кладёт результат в
+дисковый кэш ограниченного объёма; при переполнении удаляются файлы,
+которые дольше всего не отдавались.
+"""
+import fcntl
+import hashlib
+import io
+import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core import signing
+from django.http import FileResponse, HttpResponse
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare
+from PIL import Image, ImageOps
+
+from .uploads import DEFAULT_QUALITY, flatten
+
+CROPS = ('center', 'fit')
+FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+MAX_SIDE = 4096
+# Имя исходника — хэш его содержимого, так что ответ по ссылке не
+# меняется никогда.
+CACHE_MAX_AGE = 60 * 60 * 24 * 365
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# После переполнения кэш чистится с запасом, чтобы не чистить на каждой
+# записи.
+EVICT_TO = 0.9
+# Как часто обновлять время последнего обращения к файлу, секунд.
+TOUCH_INTERVAL = 60 * 60
+# Служебные файлы в корне кэша: объём и блокировка очистки.
+USAGE_FILE = '.usage'
+EVICT_LOCK_FILE = '.evict'
+
+_signer = signing.Signer(salt='posts.resize')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class Unsatisfiable(Exception):
+    """Запрошенный диапазон лежит за концом файла."""
+
+
+def _value(width, height, crop, image_format, name):
+    return f'{width}x{height}/{crop}/{image_format}/{name}'
+
+
+def resize_url(name, width, height, crop='center', image_format='jpeg'):
+    """Подписанная ссылка на картинку; саму картинку не открывает."""
+    url = reverse('posts:resize', kwargs={
+        'width': width, 'height': height, 'crop': crop,
+        'image_format': image_format, 'name': name,
+    })
+    signature = _signer.signature(
+        _value(width, height, crop, image_format, name))
+    return f'{url}?s={signature}'
+
+
+def is_valid(signature, width, height, crop, image_format, name):
+    if (crop not in CROPS or image_format not in FORMATS
+            or not 0 < width <= MAX_SIDE or not 0 < height <= MAX_SIDE):
+        return False
+    expected = _signer.signature(
+        _value(width, height, crop, image_format, name))
+    return constant_time_compare(signature or '', expected)
+
+
+def cache_key(width, height, crop, image_format, name):
+    return hashlib.sha256(_value(
+        width, height, crop, image_format, name).encode()).hexdigest()
+
+
+def render(file, width, height, crop, image_format):
+    """Байты картинки нужного размера."""
+    pil_format, _ = FORMATS[image_format]
+    with Image.open(file) as image:
+        image.draft('RGB', (width * 2, height * 2))
+        image = ImageOps.exif_transpose(image)
+        if crop == 'center':
+            image = ImageOps.fit(image, (width, height),
+                                 Image.Resampling.LANCZOS)
+        else:
+            image.thumbnail((width, height), Image.Resampling.LANCZOS)
+        image = flatten(image, keep_alpha=pil_format == 'WEBP')
+        buffer = io.BytesIO()
+        image.save(buffer, pil_format,
+                   quality=getattr(settings, 'POST_IMAGE_QUALITY',
+                                   DEFAULT_QUALITY),
+                   optimize=True)
+    return buffer.getvalue()
+
+
+class DiskCache:
+    """
+    Кэш файлов в каталоге с вытеснением давно не читанных. Время
+    обращения хранится в mtime файла. Объём кэша хранится в файле в его
+    корне и меняется под блокировкой flock, чтобы предел соблюдался для
+    всех процессов сразу.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.usage_path = os.path.join(root, USAGE_FILE)
+        self.evict_path = os.path.join(root, EVICT_LOCK_FILE)
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+        if time.time() - mtime > TOUCH_INTERVAL:
+            os.utime(path)
+        return path
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not self._usage_known():
+            # Объём считается обходом каталога до записи файла, иначе
+            # обход учтёт и его, и чужие файлы, ещё не прибавленные.
+            self.add_usage(0)
+        # Пишем во временный файл и переименовываем: параллельный запрос
+        # не увидит недописанный файл.
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(tmp, path)
+        if self.add_usage(len(data)) > self.max_bytes:
+            # Каталог чистит один процесс, остальные продолжают писать.
+            with open(self.evict_path, 'a') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return path
+                self.evict()
+        return path
+
+    def _usage_known(self):
+        try:
+            return os.path.getsize(self.usage_path) > 0
+        except FileNotFoundError:
+            return False
+
+    @contextmanager
+    def _usage_file(self):
+        os.makedirs(self.root, exist_ok=True)
+        fd = os.open(self.usage_path, os.O_RDWR | os.O_CREAT)
+        with os.fdopen(fd, 'r+') as file:
+            # Блокировка снимается при закрытии файла.
+            fcntl.flock(file, fcntl.LOCK_EX)
+            yield file
+
+    def add_usage(self, size):
+        """Прибавляет size к общему объёму и возвращает новый объём."""
+        with self._usage_file() as file:
+            text = file.read()
+            if text:
+                usage = int(text) + size
+            else:
+                usage = size + sum(
+                    file_size for _, file_size, _ in self._files())
+            file.seek(0)
+            file.truncate()
+            file.write(str(usage))
+        return usage
+
+    def _files(self):
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name in (USAGE_FILE, EVICT_LOCK_FILE):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        limit = self.max_bytes * EVICT_TO
+        removed = 0
+        for _, size, path in files:
+            if total - removed <= limit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += size
+        # Вычитаем удалённое, а не записываем обойдённый объём: другие
+        # процессы могли за это время прибавить свои файлы.
+        self.add_usage(-removed)
+
+
+_caches = {}
+
+
+def disk_cache():
+    root = settings.RESIZE_CACHE_DIR
+    max_bytes = getattr(settings, 'RESIZE_CACHE_MAX_BYTES',
+                        DEFAULT_CACHE_MAX_BYTES)
+    key = (root, max_bytes)
+    if key not in _caches:
+        _caches[key] = DiskCache(root, max_bytes)
+    return _caches[key]
+
+
+def parse_range(header, size):
+    """
+    (начало, конец) для заголовка Range с одним диапазоном или None,
+    если отдавать нужно весь файл.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        length = int(end)
+        if length == 0:
+            raise Unsatisfiable
+        start, end = max(0, size - length), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise Unsatisfiable
+    return start, end
+
+
+def file_response(request, path, content_type, etag):
+    """Ответ с файлом из кэша; поддерживает Range с одним диапазоном."""
+    size = os.path.getsize(path)
+    header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag:
+        header = None
+    try:
+        byte_range = parse_range(header, size)
+    except Unsatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        with open(path, 'rb') as file:
+            file.seek(start)
+            data = file.read(end - start + 1)
+        response = HttpResponse(data, status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=CACHE_MAX_AGE,
+                        immutable=True)
+    return response
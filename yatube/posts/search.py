@@ -0,0 +1,194 @@
+"""
+Полнотекстовый поиск по тексту постов обоих ярусов.
+
+Индекс — виртуальная таблица SQLite FTS5 posts_post_fts, где rowid
+совпадает с id поста. Таблица создаётся миграцией и поддерживается
+сигналами; архивные посты остаются в ней. rebuild() заполняет её заново.
+
+Результаты ранжируются по bm25. Лучшие SEARCH_MAX_RESULTS пар
+(score, id) запроса считаются один раз и лежат в кэше до следующего
+изменения постов, а страницы нарезаются из них курсором по (score, id).
+"""
+import bisect
+import hashlib
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connection
+
+from .cache import generation
+from .models import ArchivedPost, Post
+from .paginators import CursorPaginator, decode_cursor
+
+FTS_TABLE = 'posts_post_fts'
+SEARCH_KEYS = ('score', 'id')
+RESULTS_ON_PAGE = 10
+DEFAULT_MAX_RESULTS = 1000
+RANKED_CACHE_TIME = 60 * 60
+REBUILD_BATCH_SIZE = 1000
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(query):
+    """
+    Превращает пользовательский запрос в выражение MATCH: каждое слово
+    в кавычках и с поиском по префиксу, слова объединяются через AND.
+    """
+    words = re.findall(r'\w+', query or '')
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def index_post(post):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                       [post.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) VALUES (%s, %s)',
+            [post.pk, post.text])
+
+
+def index_new_posts(posts):
+    """Индексирует пачку постов, которых в индексе ещё нет."""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) VALUES (%s, %s)',
+            [(post.pk, post.text) for post in posts])
+
+
+def unindex_post(post_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                       [post_id])
+
+
+def rebuild():
+    """Перестраивает индекс по постам обоих ярусов."""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) '
+            f'SELECT id, text FROM {Post._meta.db_table}')
+    # Текст архивных постов сжат, поэтому он распаковывается здесь.
+    batch = []
+    for post in ArchivedPost.objects.only(
+            'id', 'text_compressed').iterator():
+        batch.append(post)
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            index_new_posts(batch)
+            batch = []
+    index_new_posts(batch)
+
+
+def filter_posts(queryset, query):
+    """Оставляет в queryset только посты, найденные индексом."""
+    expression = match_expression(query)
+    if not expression:
+        return queryset.none()
+    if not is_available():
+        return queryset.filter(text__icontains=query)
+    # RawSQL в pk__in оборачивается в лишние скобки, и SQLite сравнивает
+    # id только с первой строкой подзапроса, поэтому условие через extra.
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    return queryset.extra(
+        where=[f'{table}.id IN (SELECT rowid FROM {FTS_TABLE} '
+               f'WHERE {FTS_TABLE} MATCH %s)'],
+        params=[expression],
+    )
+
+
+def max_results():
+    return getattr(settings, 'SEARCH_MAX_RESULTS', DEFAULT_MAX_RESULTS)
+
+
+def ranked(expression):
+    """
+    Пары (score, id) лучших совпадений по возрастанию bm25 (лучшие
+    первыми). Считаются один раз на поколение кэша страниц.
+    """
+    digest = hashlib.sha256(expression.encode()).hexdigest()
+    key = f'posts:search:{generation()}:{digest}'
+    rows = cache.get(key)
+    if rows is None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT bm25({FTS_TABLE}) AS score, rowid AS id '
+                f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY score, id LIMIT %s',
+                [expression, max_results()])
+            rows = [tuple(row) for row in cursor.fetchall()]
+        cache.set(key, rows, RANKED_CACHE_TIME)
+    return rows
+
+
+def ranked_slice(rows, values, forward, limit):
+    """До limit пар из rows, ближайших к курсору values в сторону forward."""
+    if forward:
+        start = 0 if values is None else bisect.bisect_right(
+            rows, tuple(values))
+        return rows[start:start + limit]
+    end = len(rows) if values is None else bisect.bisect_left(
+        rows, tuple(values))
+    return rows[max(0, end - limit):end]
+
+
+class SearchPaginator(CursorPaginator):
+    """Курсорная выдача результатов поиска в порядке релевантности."""
+
+    def __init__(self, query, per_page, **kwargs):
+        self.keys = SEARCH_KEYS
+        self.expression = match_expression(query)
+        posts = Post.objects.select_related('author', 'group')
+        self.archived = ArchivedPost.objects.select_related(
+            'author', 'group')
+        Paginator.__init__(self, posts, per_page, **kwargs)
+
+    def key_values(self, post):
+        return [post.score, post.id]
+
+    def parse_cursor(self, token):
+        cursor = decode_cursor(token)
+        if cursor is None:
+            return None
+        direction, values = cursor
+        if (len(values) != 2 or not isinstance(values[0], (int, float))
+                or not isinstance(values[1], int)):
+            return None
+        return direction, [float(values[0]), values[1]]
+
+    def fetch(self, values, older, limit):
+        if not self.expression:
+            return []
+        rows = ranked_slice(ranked(self.expression), values, older, limit)
+        ids = [post_id for _, post_id in rows]
+        posts = self.object_list.in_bulk(ids)
+        missing = [post_id for post_id in ids if post_id not in posts]
+        if missing:
+            posts.update(self.archived.in_bulk(missing))
+        found = []
+        for score, post_id in rows:
+            post = posts.get(post_id)
+            if post is not None:
+                post.score = score
+                found.append(post)
+        return found
+
+
+def search_page(query, cursor):
+    if is_available():
+        return SearchPaginator(query, RESULTS_ON_PAGE).cursor_page(cursor)
+    posts = filter_posts(
+        Post.objects.select_related('author', 'group'), query)
+    return CursorPaginator(posts, RESULTS_ON_PAGE).cursor_page(cursor)
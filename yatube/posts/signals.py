@@ -0,0 +1,131 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import counters, images, search, timeline
+from .cache import bump_generation, bump_version
+from .models import (ArchivedPost, Comment, Follow, Group, Post,
+                     TimelineEntry)
+
+User = get_user_model()
+
+
+# Счётчики обновляются раньше раскладки ленты: timeline опирается на
+# число подписчиков автора.
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change(instance.author_id, 'posts', 1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counters.change(instance.author_id, 'posts', -1)
+
+
+# У комментариев, записей лент и строк поиска нет внешнего ключа на
+# архив: при удалении архивного поста, в том числе вместе с автором, их
+# удаляет этот обработчик.
+@receiver(post_delete, sender=ArchivedPost)
+def delete_archived_post(sender, instance, **kwargs):
+    counters.change(instance.author_id, 'posts', -1)
+    Comment.objects.filter(post_id=instance.pk).delete()
+    TimelineEntry.objects.filter(post_id=instance.pk).delete()
+    search.unindex_post(instance.pk)
+    bump_generation()
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change_comments(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    counters.change_comments(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change(instance.author_id, 'followers', 1)
+        counters.change(instance.user_id, 'following', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    counters.change(instance.author_id, 'followers', -1)
+    counters.change(instance.user_id, 'following', -1)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.push_post(instance)
+
+
+@receiver(post_save, sender=Follow)
+def fill_timeline(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.author_id:
+        timeline.add_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def trim_timeline(sender, instance, **kwargs):
+    if instance.author_id:
+        timeline.remove_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=User)
+def invalidate_pages(sender, **kwargs):
+    bump_generation()
+
+
+@receiver(post_save, sender=User)
+def invalidate_pages_on_user_change(sender, instance, update_fields=None,
+                                    **kwargs):
+    # Вход пользователя сохраняет только last_login: страницы от этого
+    # не меняются.
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        bump_generation()
+        bump_version('user', instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def invalidate_post_card(sender, instance, **kwargs):
+    bump_version('post', instance.pk)
+
+
+@receiver(post_save, sender=Group)
+def invalidate_group_cards(sender, instance, **kwargs):
+    bump_version('group', instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.unindex_post(instance.pk)
+
+
+@receiver(pre_save, sender=Post)
+def record_image_meta(sender, instance, raw=False, **kwargs):
+    # Незафиксированный файл — только что загруженный: он ещё в памяти
+    # или во временном файле, и читать его дёшево.
+    if raw:
+        return
+    if not instance.image:
+        images.clear_meta(instance)
+        instance.image_variants = ''
+    elif not instance.image._committed:
+        images.fill_meta(instance, instance.image.file)
+        instance.image_variants = ''
@@ -0,0 +1,46 @@
+"""
+Хранилище картинок, адресуемое содержимым.
+
+Файл называется по SHA-256 содержимого, поэтому одинаковые картинки
+хранятся один раз, а sorl режет для них одни и те же миниатюры. Чтобы в
+одном каталоге не копились миллионы файлов, они раскладываются по
+дереву из первых байтов хэша: posts/ab/cd/abcd....jpg. Файлы
+картинок приложение не удаляет, так что общий файл у нескольких постов
+не пропадёт при удалении одного из них.
+"""
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+from .images import digest
+
+# Имя файла, уже лежащего в дереве по хэшу.
+SHARDED_NAME = r'/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]+$'
+
+
+def sharded_name(directory, content_hash, extension):
+    return os.path.join(directory, content_hash[:2], content_hash[2:4],
+                        content_hash + extension)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def hashed_name(self, name, content):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        _, content_hash = digest(content)
+        return sharded_name(directory, content_hash, extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            return name
+        # При одновременной загрузке одной картинки FileSystemStorage
+        # сохранит второй экземпляр под другим именем — это не страшно.
+        return self._save(name, content)
@@ -0,0 +1,69 @@
+import json
+
+from django import template
+
+from ..images import CROP_RATIO
+from ..resize import resize_url
+from ..thumbnails import variant_widths
+
+register = template.Library()
+
+DEFAULT_WIDTH = 960
+
+
+def _variants(post):
+    if not hasattr(post, '_variants'):
+        post._variants = (
+            json.loads(post.image_variants) if post.image_variants else {})
+    return post._variants
+
+
+@register.filter
+def has_variants(post):
+    return bool(_variants(post))
+
+
+@register.filter
+def srcset(post, image_format='jpeg'):
+    return ', '.join(
+        f'{url} {width}w'
+        for width, url in _variants(post).get(image_format, ()))
+
+
+@register.filter
+def resized_srcset(post, image_format='jpeg'):
+    """srcset из подписанных ссылок на ресайз, пока вариантов нет."""
+    return ', '.join(
+        f'{_resized(post, width, image_format)} {width}w'
+        for width in variant_widths(post.image_width))
+
+
+@register.filter
+def resized_src(post):
+    return _resized(post, DEFAULT_WIDTH, 'jpeg')
+
+
+def _resized(post, width, image_format):
+    return resize_url(post.image.name, width, round(width * CROP_RATIO),
+                      image_format=image_format)
+
+
+@register.filter
+def variant_src(post):
+    """Вариант для браузеров без srcset: самый широкий до 960px."""
+    variants = _variants(post).get('jpeg') or [[0, post.image.url]]
+    fitting = [url for width, url in variants if width <= DEFAULT_WIDTH]
+    return fitting[-1] if fitting else variants[0][1]
+
+
+@register.filter
+def image_style(post):
+    """
+    Пропорции карточки, чтобы место под картинку было занято до
+    загрузки, и заглушка фоном.
+    """
+    style = f'aspect-ratio: 1 / {round(CROP_RATIO, 4)};'
+    if post.image_placeholder:
+        style += (f' background: center / cover no-repeat '
+                  f'url({post.image_placeholder});')
+    return style
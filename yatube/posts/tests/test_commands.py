@@ -0,0 +1,464 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from http import HTTPStatus
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .. import archive, search, thumbnails, timeline
+from ..management.commands.shard_images import Command as ShardCommand
+from ..models import (ArchivedPost, Comment, Follow, Group, Post,
+                      TimelineEntry, UserCounters)
+from ..storage import SHARDED_NAME
+from .utils import TempKVStoreMixin
+
+User = get_user_model()
+
+
+class RecountCountersTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.post = Post.objects.create(text='Тестовый пост', author=cls.author)
+        Post.objects.create(text='Второй пост', author=cls.author)
+        Comment.objects.create(post=cls.post, author=cls.reader, text='Да')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def assert_counters(self):
+        author = UserCounters.objects.get(user=self.author)
+        reader = UserCounters.objects.get(user=self.reader)
+        self.assertEqual(
+            (author.posts, author.followers, author.following), (2, 1, 0))
+        self.assertEqual(
+            (reader.posts, reader.followers, reader.following), (0, 0, 1))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+
+    def test_counters_follow_changes(self):
+        """Счётчики обновляются при создании и удалении объектов"""
+        self.assert_counters()
+        Follow.objects.filter(user=self.reader).delete()
+        Comment.objects.all().delete()
+        self.assertEqual(self.author.counters.followers, 0)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 0)
+
+    def test_recount_repairs_drift(self):
+        """Команда recount_counters исправляет расхождения"""
+        UserCounters.objects.update(posts=7, followers=7, following=7)
+        Post.objects.update(comments_count=7)
+        call_command('recount_counters', batch_size=1, stdout=StringIO())
+        self.assert_counters()
+
+
+class BackfillImageMetaTests(TestCase):
+    def test_backfill(self):
+        """Команда заполняет сведения о картинках старых постов"""
+        author = User.objects.create_user(username='author')
+        post = Post.objects.create(
+            text='Пост с картинкой', author=author,
+            image=SimpleUploadedFile(
+                name='backfill.gif',
+                content=(
+                    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+                    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+                    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+                    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+                    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+                    b'\x0A\x00\x3B'),
+                content_type='image/gif'))
+        missing = Post.objects.create(
+            text='Файл потерян', author=author, image='posts/missing.gif')
+        Post.objects.create(text='Без картинки', author=author)
+        expected = Post.objects.values_list(
+            'image_width', 'image_height', 'image_size', 'image_hash',
+            'image_placeholder').get(pk=post.pk)
+        Post.objects.update(image_width=None, image_height=None,
+                            image_size=None, image_hash='',
+                            image_placeholder='')
+        out, err = StringIO(), StringIO()
+        call_command('backfill_image_meta', batch_size=1,
+                     stdout=out, stderr=err)
+        self.assertEqual(Post.objects.values_list(
+            'image_width', 'image_height', 'image_size', 'image_hash',
+            'image_placeholder').get(pk=post.pk), expected)
+        self.assertEqual(expected[:2], (2, 1))
+        self.assertIn('Заполнено: 1, не удалось прочитать: 1',
+                      out.getvalue())
+        self.assertIn(missing.image.name, err.getvalue())
+
+
+class ShardImagesTests(TempKVStoreMixin, TestCase):
+    def test_shard(self):
+        """Команда переносит картинки в дерево по хэшу"""
+        author = User.objects.create_user(username='author')
+        storage = Post._meta.get_field('image').storage
+        old = storage._save('posts/flat.gif', ContentFile(b'GIF89a'))
+        first = Post.objects.create(text='Один', author=author, image=old)
+        second = Post.objects.create(text='Два', author=author, image=old)
+        lost = Post.objects.create(
+            text='Потерян', author=author, image='posts/lost.gif')
+        Post.objects.update(image_variants='{"jpeg": [[480, "/old.jpg"]]}')
+        out, err = StringIO(), StringIO()
+        with mock.patch.object(thumbnails, 'schedule_on_commit') as schedule:
+            call_command(
+                'shard_images', batch_size=1, stdout=out, stderr=err)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        lost.refresh_from_db()
+        self.assertRegex(first.image.name, SHARDED_NAME)
+        self.assertTrue(first.image.name.startswith('posts/'))
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(lost.image.name, 'posts/lost.gif')
+        # Варианты старого файла удалены вместе с ним и режутся заново.
+        self.assertEqual(first.image_variants, '')
+        self.assertNotEqual(lost.image_variants, '')
+        schedule.assert_called_once_with(first.image.name, storage)
+        self.assertTrue(storage.exists(first.image.name))
+        self.assertFalse(storage.exists(old))
+        self.assertIn('Перенесено: 2, не удалось прочитать: 1',
+                      out.getvalue())
+
+    def test_shard_archived(self):
+        """Архивные посты переезжают вместе с обычными и не теряют файл"""
+        author = User.objects.create_user(username='author')
+        storage = Post._meta.get_field('image').storage
+        shared = storage._save('posts/shared.gif', ContentFile(b'GIF89a'))
+        solo = storage._save('posts/solo.gif', ContentFile(b'GIF87a'))
+        old = Post.objects.create(text='Старый', author=author, image=shared)
+        alone = Post.objects.create(text='Один', author=author, image=solo)
+        archive.archive_batch(alone.pub_date + timedelta(seconds=1), 100)
+        hot = Post.objects.create(text='Новый', author=author, image=shared)
+        with mock.patch.object(thumbnails, 'schedule_on_commit'):
+            call_command('shard_images', stdout=StringIO())
+        hot.refresh_from_db()
+        old = ArchivedPost.objects.get(pk=old.pk)
+        alone = ArchivedPost.objects.get(pk=alone.pk)
+        self.assertEqual(old.image.name, hot.image.name)
+        self.assertRegex(alone.image.name, SHARDED_NAME)
+        for name in (hot.image.name, alone.image.name):
+            self.assertTrue(storage.exists(name))
+        self.assertFalse(storage.exists(shared))
+        self.assertFalse(storage.exists(solo))
+
+    def test_keep_referenced(self):
+        """Файл, на который ещё ссылается пост, не удаляется"""
+        author = User.objects.create_user(username='author')
+        storage = Post._meta.get_field('image').storage
+        old = storage._save('posts/flat.gif', ContentFile(b'GIF89a'))
+        Post.objects.create(text='Один', author=author, image=old)
+        # Пока шёл перенос, появился пост со старым путём.
+        ShardCommand().cleanup(storage, {old: 'posts/new.gif'})
+        self.assertTrue(storage.exists(old))
+
+
+class BuildImageVariantsTests(TempKVStoreMixin, TestCase):
+    def test_build(self):
+        """Команда режет варианты для постов без них"""
+        author = User.objects.create_user(username='author')
+        storage = Post._meta.get_field('image').storage
+        gif = (b'\x47\x49\x46\x38\x39\x61\x02\x00'
+               b'\x01\x00\x80\x00\x00\x00\x00\x00'
+               b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+               b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+               b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+               b'\x0A\x00\x3B')
+        old = Post.objects.create(
+            text='Архив', author=author,
+            image=storage._save('posts/archived.gif', ContentFile(gif)))
+        archive.archive_batch(old.pub_date + timedelta(seconds=1), 100)
+        name = storage._save('posts/variants.gif', ContentFile(gif))
+        for text in ('Один', 'Два'):
+            Post.objects.create(text=text, author=author, image=name)
+        out = StringIO()
+        call_command('build_image_variants', batch_size=1, stdout=out)
+        self.assertFalse(Post.objects.filter(image_variants='').exists())
+        self.assertFalse(
+            ArchivedPost.objects.filter(image_variants='').exists())
+        self.assertIn('Готово картинок: 2, без файла: 0', out.getvalue())
+
+
+class ArchivePostsTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.old = Post.objects.create(text='Старый пост', author=self.author)
+        Post.objects.create(text='Давний пост', author=self.author)
+        self.new = Post.objects.create(text='Новый пост', author=self.author)
+        self.old_date = timezone.now() - timedelta(days=400)
+        Post.objects.exclude(pk=self.new.pk).update(pub_date=self.old_date)
+        Comment.objects.create(post=self.old, author=self.reader, text='Да')
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def test_archive(self):
+        """Старые посты уходят в архив, а страницы читают оба яруса"""
+        out = StringIO()
+        call_command('archive_posts', days=30, batch_size=1, stdout=out)
+        self.assertIn('В архиве новых постов: 2', out.getvalue())
+        self.assertEqual(list(Post.objects.all()), [self.new])
+        self.assertEqual(ArchivedPost.objects.get(pk=self.old.pk).text,
+                         'Старый пост')
+        self.assertEqual(TimelineEntry.objects.count(), 3)
+        self.assertEqual(self.author.counters.posts, 3)
+        response = self.client.get(
+            reverse('posts:profile', args=['author']))
+        self.assertEqual(
+            [post.text for post in response.context['page_obj']],
+            ['Новый пост', 'Давний пост', 'Старый пост'])
+        response = self.client.get(
+            reverse('posts:post_detail', args=[self.old.pk]))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, 'Старый пост')
+        self.assertEqual(len(response.context['comments']), 1)
+        response = self.client.get(reverse('posts:index') + '?page=1')
+        self.assertEqual(len(response.context['page_obj']), 3)
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            [post.text for post in response.context['page_obj']],
+            ['Новый пост', 'Давний пост', 'Старый пост'])
+        self.assertEqual(response.context['page_obj'].paginator.count, 3)
+        self.assertEqual(timeline.rebuild(self.reader.id), 3)
+        call_command('recount_counters', stdout=StringIO())
+        self.assertEqual(UserCounters.objects.get(user=self.author).posts, 3)
+
+    def test_delete_archived(self):
+        """Удаление архивного поста и его комментариев меняет счётчики"""
+        call_command('archive_posts', days=30, stdout=StringIO())
+        Comment.objects.get(post_id=self.old.pk).delete()
+        self.assertEqual(
+            ArchivedPost.objects.get(pk=self.old.pk).comments_count, 0)
+        Comment.objects.create(post_id=self.old.pk, author=self.reader,
+                               text='Снова')
+        self.assertEqual(
+            ArchivedPost.objects.get(pk=self.old.pk).comments_count, 1)
+        self.author.delete()
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    def test_edit_restores_post(self):
+        """Из архива пост возвращает только сохранённая правка автора"""
+        call_command('archive_posts', days=30, stdout=StringIO())
+        url = reverse('posts:post_edit', args=[self.old.pk])
+        self.client.get(url)
+        self.client.post(url, {'text': 'Чужая правка'})
+        author = Client()
+        author.force_login(self.author)
+        response = author.get(url)
+        self.assertEqual(response.context['form'].initial['text'],
+                         'Старый пост')
+        self.assertFalse(Post.objects.filter(pk=self.old.pk).exists())
+        author.post(url, {'text': 'Правка'})
+        post = Post.objects.get(pk=self.old.pk)
+        self.assertEqual((post.text, post.pub_date), ('Правка', self.old_date))
+        self.assertFalse(ArchivedPost.objects.filter(pk=post.pk).exists())
+
+    def test_comment_restores_post(self):
+        """Новый комментарий возвращает пост из архива"""
+        call_command('archive_posts', days=30, stdout=StringIO())
+        self.client.post(reverse('posts:add_comment', args=[self.old.pk]),
+                         {'text': 'Ещё'})
+        post = Post.objects.get(pk=self.old.pk)
+        self.assertEqual((post.text, post.pub_date, post.comments_count),
+                         ('Старый пост', self.old_date, 2))
+        self.assertFalse(ArchivedPost.objects.filter(pk=post.pk).exists())
+        self.assertEqual(self.author.counters.posts, 3)
+
+
+class ImportDataTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text)
+        return path
+
+    def test_import_jsonl(self):
+        """Команда пачками пишет все модели и обновляет производные данные"""
+        records = [
+            {'model': 'user', 'username': 'author'},
+            {'model': 'user', 'username': 'reader'},
+            {'model': 'group', 'slug': 'cats', 'title': 'Коты'},
+            {'model': 'post', 'id': 10, 'author': 'author', 'group': 'cats',
+             'text': 'Пост о котах', 'pub_date': '2020-01-02T03:04:05'},
+            {'model': 'post', 'id': 11, 'author': 'nobody', 'text': 'Чей?'},
+            {'model': 'comment', 'id': 7, 'post': 10, 'author': 'reader',
+             'text': 'Мяу', 'created': '2020-01-03T00:00:00'},
+            {'model': 'follow', 'user': 'reader', 'author': 'author'},
+            {'model': 'user', 'username': 'author'},
+        ]
+        path = self.write('data.jsonl', '\n'.join(
+            json.dumps(record, ensure_ascii=False) for record in records))
+        out, err = StringIO(), StringIO()
+        call_command('import_data', path, batch_size=2, stdout=out,
+                     stderr=err)
+        self.assertIn('Записано: 6, уже были: 1, пропущено: 1',
+                      out.getvalue())
+        self.assertIn('nobody', err.getvalue())
+        post = Post.objects.get()
+        self.assertEqual((post.group.slug, post.pub_date.year),
+                         ('cats', 2020))
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(post.comments.get().created.year, 2020)
+        author = User.objects.get(username='author')
+        self.assertEqual((author.counters.posts, author.counters.followers),
+                         (1, 1))
+        self.assertTrue(TimelineEntry.objects.filter(
+            user__username='reader', post=post).exists())
+        self.assertEqual(
+            list(search.filter_posts(Post.objects.all(), 'котах')), [post])
+        out = StringIO()
+        call_command('import_data', path, stdout=out, stderr=StringIO())
+        self.assertIn('Записано: 0, уже были: 7', out.getvalue())
+        self.assertEqual(Comment.objects.count(), 1)
+
+    def test_source_ids_mapped(self):
+        """id из файла не совпадают с id существующих постов"""
+        author = User.objects.create_user(username='author')
+        local = Post.objects.create(text='Свой пост', author=author)
+        records = [
+            {'model': 'post', 'id': local.pk, 'author': 'author',
+             'text': 'Чужой пост'},
+            {'model': 'comment', 'id': 1, 'post': local.pk,
+             'author': 'author', 'text': 'К чужому'},
+        ]
+        path = self.write('data.jsonl', '\n'.join(
+            json.dumps(record) for record in records))
+        call_command('import_data', path, stdout=StringIO())
+        self.assertEqual(Post.objects.get(pk=local.pk).text, 'Свой пост')
+        imported = Post.objects.get(text='Чужой пост')
+        self.assertEqual(imported.comments.get().text, 'К чужому')
+        self.assertEqual(
+            Post.objects.create(text='Ещё', author=author).pk,
+            imported.pk + 1)
+
+    def test_fan_out_per_batch(self):
+        """Подписчики авторов читаются один раз на пачку постов"""
+        author = User.objects.create_user(username='author')
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=author)
+        path = self.write('posts.csv', 'id,author,text\n' + ''.join(
+            f'{number},author,Пост {number}\n' for number in range(3)))
+        with CaptureQueriesContext(connection) as queries:
+            call_command('import_data', path, model='post',
+                         stdout=StringIO())
+        self.assertEqual(reader.timeline.count(), 3)
+        self.assertEqual(len([
+            query for query in queries
+            if query['sql'].startswith('SELECT')
+            and 'FROM "posts_follow"' in query['sql']
+        ]), 1)
+
+    def test_follows_fan_out_per_batch(self):
+        """Посты авторов читаются один раз на пачку подписок"""
+        authors = [User.objects.create_user(username=f'author{number}')
+                   for number in range(2)]
+        for author in authors:
+            Post.objects.create(text=f'Пост {author.username}',
+                                author=author)
+        path = self.write('follows.csv', 'user,author\n' + ''.join(
+            f'reader{reader},{author.username}\n'
+            for reader in range(2) for author in authors))
+        for reader in range(2):
+            User.objects.create_user(username=f'reader{reader}')
+        with CaptureQueriesContext(connection) as queries:
+            call_command('import_data', path, model='follow',
+                         stdout=StringIO())
+        self.assertEqual(TimelineEntry.objects.count(), 4)
+        self.assertEqual(len([
+            query for query in queries
+            if query['sql'].startswith('SELECT')
+            and 'FROM "posts_post"' in query['sql']
+        ]), 1)
+
+    def test_ids_reserved_under_write_lock(self):
+        """Наибольший id читается, когда транзакция уже пишет"""
+        User.objects.create_user(username='author')
+        path = self.write('posts.csv', 'id,author,text\n1,author,Пост\n')
+        with CaptureQueriesContext(connection) as queries:
+            call_command('import_data', path, model='post',
+                         stdout=StringIO())
+        sql = [query['sql'] for query in queries]
+        top = next(number for number, query in enumerate(sql)
+                   if 'MAX("posts_post"."id")' in query)
+        self.assertTrue(any(
+            query.startswith('UPDATE "posts_post"') for query in sql[:top]))
+
+    def test_plain_password_rejected(self):
+        """Пароль принимается только в виде хеша"""
+        path = self.write('users.csv', 'username,password\n'
+                                       'plain,secret\n'
+                                       f'hashed,{make_password("secret")}\n')
+        err = StringIO()
+        call_command('import_data', path, model='user', stdout=StringIO(),
+                     stderr=err)
+        self.assertIn('plain', err.getvalue())
+        self.assertFalse(User.objects.filter(username='plain').exists())
+        self.assertTrue(
+            User.objects.get(username='hashed').check_password('secret'))
+
+    def test_import_csv(self):
+        """CSV читается с моделью из аргумента"""
+        User.objects.create_user(username='author')
+        path = self.write('posts.csv', 'id,author,text\n'
+                                       '1,author,Первый\n'
+                                       '2,author,Второй\n')
+        call_command('import_data', path, model='post', stdout=StringIO())
+        self.assertEqual(Post.objects.count(), 2)
+
+
+class ExportUserTests(TestCase):
+    def test_round_trip(self):
+        """Выгрузку команды export_user загружает import_data в пустую базу"""
+        author = User.objects.create_user(username='author',
+                                          first_name='Лев')
+        group = Group.objects.create(title='Группа', slug='group')
+        post = Post.objects.create(text='Пост', author=author, group=group)
+        Comment.objects.create(post=post, author=author, text='Да')
+        stranger = User.objects.create_user(username='stranger')
+        other = Post.objects.create(text='Чужой пост', author=stranger)
+        Comment.objects.create(post=other, author=author, text='Нет')
+        gone = Post.objects.create(text='Удалённый пост', author=stranger)
+        Comment.objects.create(post=gone, author=author, text='Потерян')
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'author.jsonl')
+        call_command('export_user', 'author', output=path, chunk_size=1,
+                     stdout=StringIO())
+        author.delete()
+        group.delete()
+        gone_id = gone.pk
+        gone.delete()
+        err = StringIO()
+        call_command('import_data', path, stdout=StringIO(), stderr=err)
+        self.assertIn(f'нет поста {gone_id}', err.getvalue())
+        self.assertEqual(len(err.getvalue().splitlines()), 1)
+        post = Post.objects.get(author__username='author')
+        self.assertEqual(
+            (post.text, post.comments.get().text, post.group.title,
+             post.author.first_name),
+            ('Пост', 'Да', 'Группа', 'Лев'))
+        comment = other.comments.get()
+        self.assertEqual((comment.text, comment.author.username),
+                         ('Нет', 'author'))
+        other.refresh_from_db()
+        self.assertEqual(other.comments_count, 1)
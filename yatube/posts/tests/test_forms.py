@@ -1,10 +1,16 @@
+import base64
+import hashlib
+import io
 from http import HTTPStatus
+from unittest import mock
 
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 
+from .. import uploads, views
 from ..models import Comment, Group, Post
 
 User = get_user_model()
@@ -58,10 +64,82 @@ class PostCreateFormTests(TestCase):
         self.assertEqual(post.group, self.group, error_not_equal)
         self.assertEqual(post.author, form_data['author'],
                          error_not_equal)
-        self.assertEqual(post.image.name, 'posts/small.gif',
-                         error_not_equal)
+        content_hash = hashlib.sha256(small_gif).hexdigest()
+        self.assertEqual(
+            post.image.name,
+            f'posts/{content_hash[:2]}/{content_hash[2:4]}/'
+            f'{content_hash}.gif',
+            error_not_equal)
+        self.assertEqual(
+            (post.image_width, post.image_height, post.image_size,
+             post.image_hash),
+            (2, 1, len(small_gif), hashlib.sha256(small_gif).hexdigest()),
+            'Сведения о картинке не сохранены')
         self.assertEqual(Post.objects.count(), 1, 'Поcт не добавлен БД')
 
+    def test_same_image_stored_once(self):
+        '''Одинаковые картинки сохраняются в один файл'''
+        small_gif = (
+            b'\x47\x49\x46\x38\x39\x61\x01\x00'
+            b'\x01\x00\x80\x00\x00\x00\x00\x00'
+            b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+            b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+            b'\x01\x00\x01\x00\x00\x02\x02\x0C'
+            b'\x0A\x00\x3B'
+        )
+        for name in ('first.gif', 'second.GIF'):
+            self.authorized_client.post(
+                reverse('posts:post_create'),
+                data={'text': name, 'image': SimpleUploadedFile(
+                    name=name, content=small_gif, content_type='image/gif')})
+        first, second = Post.objects.order_by('pk')
+        self.assertEqual(first.image.name, second.image.name)
+        with first.image.open('rb') as file:
+            self.assertEqual(file.read(), small_gif)
+
+    @override_settings(POST_IMAGE_MAX_SIDE=100)
+    def test_uploaded_image_normalized(self):
+        '''Картинка поворачивается, теряет EXIF и уменьшается'''
+        exif = Image.Exif()
+        exif[uploads.ORIENTATION_TAG] = 6
+        source = io.BytesIO()
+        Image.new('RGB', (300, 200), (200, 30, 30)).save(
+            source, 'PNG', exif=exif.tobytes())
+        uploads.stats.clear()
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Большая картинка', 'image': SimpleUploadedFile(
+                name='photo.png', content=source.getvalue(),
+                content_type='image/png')})
+        post = Post.objects.get(text='Большая картинка')
+        self.assertTrue(post.image.name.endswith('.jpg'))
+        self.assertEqual((post.image_width, post.image_height), (67, 100))
+        with post.image.open('rb'), Image.open(post.image) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertNotIn('exif', image.info)
+        prefix = 'data:image/png;base64,'
+        self.assertTrue(post.image_placeholder.startswith(prefix))
+        placeholder = io.BytesIO(
+            base64.b64decode(post.image_placeholder[len(prefix):]))
+        with Image.open(placeholder) as image:
+            self.assertEqual(image.size, (16, 6))
+        self.assertEqual(uploads.stats['bytes_in'], len(source.getvalue()))
+        self.assertEqual(uploads.stats['bytes_out'], post.image_size)
+
+    def test_truncated_image_rejected(self):
+        '''Обрезанная картинка даёт ошибку формы, а не 500'''
+        source = io.BytesIO()
+        Image.effect_noise((300, 200), 64).convert('RGB').save(
+            source, 'JPEG', exif=Image.Exif().tobytes())
+        response = self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Битая картинка', 'image': SimpleUploadedFile(
+                name='broken.jpg', content=source.getvalue()[:2000],
+                content_type='image/jpeg')})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn('image', response.context['form'].errors)
+        self.assertFalse(Post.objects.filter(text='Битая картинка').exists())
+
     def test_can_edit_post_authorized_client(self):
         '''Проверка возможности редактирования поста'''
         new_post = Post.objects.create(
@@ -92,6 +170,20 @@ class PostCreateFormTests(TestCase):
         self.assertEqual(self.group.posts.count(), 0,
                          'Пост после смены группы остался в старой группе')
 
+    def test_edit_keeps_comments_count(self):
+        '''Правка не затирает счётчик комментариев, выросший за время неё'''
+        post = Post.objects.create(text='Исходный текст', author=self.user)
+        stale = Post.objects.get(pk=post.pk)
+        Comment.objects.create(post=post, author=self.user, text='Да')
+        with mock.patch.object(views.archive, 'find_post',
+                               return_value=stale):
+            self.authorized_client.post(
+                reverse('posts:post_edit', kwargs={'post_id': post.id}),
+                data={'text': 'Новый текст'})
+        post.refresh_from_db()
+        self.assertEqual((post.text, post.comments_count),
+                         ('Новый текст', 1))
+
     def test_can_not_edit_post_non_author(self):
         '''Проверка запрета создания поста не авторизованному пользователю'''
         form_data = {'text': 'Текст записанный в форму',
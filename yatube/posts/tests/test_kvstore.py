@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase, override_settings
+from sorl.thumbnail.images import ImageFile
+
+from .. import kvstore
+
+
+class KVStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        settings = override_settings(
+            THUMBNAIL_KVSTORE_FILE=os.path.join(self.tmp, 'kv.sqlite3'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(shutil.rmtree, self.tmp)
+        kvstore.stats.clear()
+        self.store = kvstore.KVStore()
+        self.image = ImageFile('posts/small.gif')
+        self.image.set_size((2, 1))
+
+    def test_lru_in_front_of_file(self):
+        """Повторный поиск идёт из LRU, другой процесс читает файл"""
+        self.assertIsNone(self.store.get(self.image))
+        self.store.set(self.image)
+        self.assertEqual(self.store.get(self.image).size, [2, 1])
+        self.assertEqual(kvstore.KVStore().get(self.image).size, [2, 1])
+        self.assertEqual(
+            (kvstore.stats['hits'], kvstore.stats['file_hits'],
+             kvstore.stats['misses']), (1, 1, 1))
+        report = kvstore.report()
+        self.assertEqual(report['lookups'], 3)
+        self.assertAlmostEqual(report['hit_rate'], 1 / 3)
+
+    def test_lru_size(self):
+        """LRU вытесняет давно не читанные ключи"""
+        with override_settings(THUMBNAIL_KVSTORE_LRU_SIZE=1):
+            store = kvstore.KVStore()
+        other = ImageFile('posts/other.gif')
+        other.set_size((1, 1))
+        store.set(self.image)
+        store.set(other)
+        self.assertEqual(len(store.lru.data), 1)
+        self.assertIsNotNone(store.get(self.image))
+        self.assertEqual(kvstore.stats['file_hits'], 1)
+
+    def test_delete_and_clear(self):
+        """Удаление и очистка убирают ключи из LRU и файла"""
+        self.store.set(self.image)
+        self.store.delete(self.image, delete_thumbnails=False)
+        self.assertIsNone(self.store.get(self.image))
+        self.store.set(self.image)
+        self.store.clear()
+        self.assertIsNone(kvstore.KVStore().get(self.image))
+        self.assertIsNone(self.store.get(self.image))
@@ -0,0 +1,90 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+# Признаки плохого плана SQLite: временная сортировка и полный
+# просмотр таблицы без индекса.
+TEMP_SORT = 'USE TEMP B-TREE'
+
+
+def full_scans(plan):
+    return [
+        detail for detail in plan
+        if detail.startswith('SCAN') and 'USING' not in detail
+    ]
+
+
+class QueryPlanTests(TestCase):
+    """EXPLAIN каждого запроса списочных страниц: только по индексам."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test_group',
+            description='Тестовое описание',
+        )
+        Post.objects.bulk_create([
+            Post(text=f'Пост {i}', author=cls.author, group=cls.group)
+            for i in range(15)
+        ])
+        cls.post = Post.objects.create(
+            text='Пост с комментариями', author=cls.author, group=cls.group)
+        Comment.objects.create(post=cls.post, author=cls.reader, text='Да')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Проверка планов написана для SQLite')
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assert_plans(self, url, params=None):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        for query in context.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or 'posts_' not in sql:
+                continue
+            plan = self.explain(sql)
+            with self.subTest(url=url, sql=sql):
+                self.assertFalse(full_scans(plan),
+                                 f'Полный просмотр таблицы: {plan}')
+                self.assertFalse(
+                    [detail for detail in plan if TEMP_SORT in detail],
+                    f'Временная сортировка: {plan}')
+        return response
+
+    def test_list_views_use_indexes(self):
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile',
+                    kwargs={'username': self.author.username}),
+            reverse('posts:follow_index'),
+        )
+        for url in urls:
+            page_obj = self.assert_plans(url).context['page_obj']
+            self.assertTrue(page_obj.next_cursor)
+            self.assert_plans(url, {'cursor': page_obj.next_cursor})
+
+    def test_post_detail_uses_indexes(self):
+        self.assert_plans(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}))
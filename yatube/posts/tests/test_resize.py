@@ -0,0 +1,134 @@
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+from http import HTTPStatus
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from PIL import Image
+
+from .. import resize
+from ..models import Post
+
+
+class ResizeViewTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        source = io.BytesIO()
+        Image.new('RGB', (400, 300), (10, 120, 200)).save(source, 'JPEG')
+        storage = Post._meta.get_field('image').storage
+        cls.name = storage.save('posts/resize.jpg',
+                                ContentFile(source.getvalue()))
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        settings = override_settings(RESIZE_CACHE_DIR=self.tmp)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.client = Client()
+        self.url = resize.resize_url(self.name, 200, 100)
+
+    def test_resize(self):
+        """Ссылка отдаёт картинку нужного размера и кэшируется на диске"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) \
+                as image:
+            self.assertEqual(image.size, (200, 100))
+        with mock.patch.object(resize, 'render') as render:
+            response = self.client.get(self.url)
+        render.assert_not_called()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_corrupt_source(self):
+        """Битая исходная картинка даёт 404, а не ошибку сервера"""
+        storage = Post._meta.get_field('image').storage
+        name = storage.save('posts/broken.jpg', ContentFile(b'not a jpeg'))
+        self.addCleanup(storage.delete, name)
+        response = self.client.get(resize.resize_url(name, 200, 100))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_bad_signature(self):
+        """Ссылку нельзя подделать"""
+        url = self.url.replace('200x100', '400x200')
+        self.assertEqual(self.client.get(url).status_code,
+                         HTTPStatus.NOT_FOUND)
+        self.assertEqual(
+            self.client.get(self.url.split('?')[0]).status_code,
+            HTTPStatus.NOT_FOUND)
+
+    def test_range_and_conditional(self):
+        """Поддерживаются Range и If-None-Match"""
+        full = self.client.get(self.url)
+        size = int(full['Content-Length'])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, HTTPStatus.PARTIAL_CONTENT)
+        self.assertEqual(len(response.content), 10)
+        self.assertEqual(response['Content-Range'], f'bytes 0-9/{size}')
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(response['Content-Range'],
+                         f'bytes {size - 5}-{size - 1}/{size}')
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={size}-')
+        self.assertEqual(response.status_code,
+                         HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+        response = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=full['ETag'])
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+
+def fill_cache(root, prefix, count, barrier):
+    disk_cache = resize.DiskCache(root, max_bytes=250)
+    for number in range(count):
+        disk_cache.put(f'{prefix}{number:02}', b'x' * 10)
+        if number == 0:
+            # Дальше процессы пишут одновременно.
+            barrier.wait()
+
+
+class DiskCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_evicts_least_recently_used(self):
+        """При переполнении удаляются давно не читанные файлы"""
+        disk_cache = resize.DiskCache(self.tmp, max_bytes=35)
+        for age, key in enumerate(('cc', 'bb', 'aa')):
+            path = disk_cache.put(key, b'x' * 10)
+            old = 1000 - age * 100
+            os.utime(path, (old, old))
+        disk_cache.get('cc')
+        disk_cache.put('dd', b'x' * 10)
+        self.assertIsNotNone(disk_cache.get('cc'))
+        self.assertIsNotNone(disk_cache.get('dd'))
+        self.assertIsNotNone(disk_cache.get('bb'))
+        self.assertIsNone(disk_cache.get('aa'))
+
+    def test_usage_shared_between_processes(self):
+        """Объём кэша общий для всех процессов"""
+        context = multiprocessing.get_context('fork')
+        barrier = context.Barrier(3)
+        workers = [
+            context.Process(target=fill_cache,
+                            args=(self.tmp, prefix, 20, barrier))
+            for prefix in ('aa', 'bb', 'cc')]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+        # Каждый процесс записал 200 байт при пределе 250: при раздельном
+        # учёте никто из них не стал бы чистить каталог. Пока один процесс
+        # чистит, другие могут дописать пару файлов сверх предела.
+        disk_cache = resize.DiskCache(self.tmp, max_bytes=250)
+        on_disk = sum(size for _, size, _ in disk_cache._files())
+        self.assertLess(on_disk, 300)
+        self.assertEqual(disk_cache.add_usage(0), on_disk)
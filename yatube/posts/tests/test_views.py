@@ -1,11 +1,27 @@
+import io
+import json
+import time
+import zipfile
+from datetime import timedelta
+from http import HTTPStatus
+from unittest import mock
+
 from django import forms
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.db import connection
+from django.db.models import F
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from ..models import Follow, Group, Post
+from .. import cache as cache_utils
+from .. import archive, export, resize, search, thumbnails, timeline
+from ..models import (ArchivedPost, CacheVersion, Comment, Follow, Group,
+                      Post)
+from ..paginators import COMMENTS_ON_PAGE
+from .utils import TempKVStoreMixin
 
 TEST_OF_POST = 13
 
@@ -256,6 +272,234 @@ class PaginatorViewsTest(TestCase):
                 self.assertEqual(len(response1.context['page_obj']), 10)
                 self.assertEqual(len(response2.context['page_obj']), 3)
 
+    def test_cursor_pages(self):
+        '''Проверка переходов по курсору вперёд и назад'''
+        pages = (
+            self.index_url[0],
+            self.group_list_url[0],
+            self.profile_url[0],
+        )
+        for page in pages:
+            with self.subTest(page=page):
+                cache.clear()
+                first = self.guest_client.get(page).context['page_obj']
+                self.assertIsNone(first.previous_cursor)
+                second = self.guest_client.get(
+                    page, {'cursor': first.next_cursor}).context['page_obj']
+                self.assertEqual(len(second), 3)
+                self.assertIsNone(second.next_cursor)
+                self.assertFalse(set(first) & set(second))
+                back = self.guest_client.get(
+                    page,
+                    {'cursor': second.previous_cursor}).context['page_obj']
+                self.assertEqual(list(back), list(first))
+
+    def test_broken_cursor_returns_first_page(self):
+        '''Битый курсор открывает первую страницу'''
+        cache.clear()
+        response = self.guest_client.get(
+            self.profile_url[0], {'cursor': 'not-a-cursor'})
+        self.assertEqual(len(response.context['page_obj']), 10)
+
+
+class CommentsPaginationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(text='Тестовый пост', author=cls.user)
+        Comment.objects.bulk_create([
+            Comment(post=cls.post, author=cls.user, text=f'Комментарий {i}')
+            for i in range(COMMENTS_ON_PAGE + 5)
+        ])
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def test_post_detail_shows_newest_comments(self):
+        """На странице поста только первая порция комментариев"""
+        response = self.guest_client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}))
+        comments = response.context['comments']
+        self.assertEqual(len(comments), COMMENTS_ON_PAGE)
+        self.assertEqual(comments[0].text,
+                         f'Комментарий {COMMENTS_ON_PAGE + 4}')
+        self.assertTrue(comments.next_cursor)
+
+    def test_comments_fragment(self):
+        """Фрагмент отдаёт следующую порцию комментариев"""
+        first = self.guest_client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}))
+        response = self.guest_client.get(
+            reverse('posts:comments', kwargs={'post_id': self.post.id}),
+            {'cursor': first.context['comments'].next_cursor})
+        self.assertTemplateUsed(response, 'includes/comments.html')
+        self.assertEqual(
+            [comment.text for comment in response.context['comments']],
+            [f'Комментарий {i}' for i in range(4, -1, -1)])
+        self.assertNotContains(response, 'js-more-comments')
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(title='Тестовая группа',
+                                         slug='test_group')
+        cls.post = Post.objects.create(
+            text='Тестовый пост', author=cls.user, group=cls.group)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        self.urls = (
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}),
+            reverse('posts:profile', kwargs={'username': self.user.username}),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+        )
+
+    def test_not_modified(self):
+        """Повторный запрос с совпавшим ETag получает 304 без шаблона"""
+        for url in self.urls:
+            with self.subTest(url=url):
+                etag = self.authorized_client.get(url)['ETag']
+                response = self.authorized_client.get(
+                    url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code,
+                                 HTTPStatus.NOT_MODIFIED)
+                self.assertFalse(response.templates)
+
+    def test_changes_update_etag(self):
+        """Новый комментарий и правка поста меняют ETag"""
+        url = self.urls[0]
+        etag = self.authorized_client.get(url)['ETag']
+        Comment.objects.create(post=self.post, author=self.user, text='Да')
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        for url in self.urls:
+            with self.subTest(url=url):
+                etag = self.authorized_client.get(url)['ETag']
+                post = Post.objects.get(pk=self.post.pk)
+                post.text = f'Правка для {url}'
+                post.save()
+                response = self.authorized_client.get(
+                    url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_commenter_change_updates_post_etag(self):
+        """Смена имени комментатора меняет ETag страницы поста"""
+        commenter = User.objects.create_user(username='commenter')
+        Comment.objects.create(post=self.post, author=commenter, text='Да')
+        url = self.urls[0]
+        etag = self.authorized_client.get(url)['ETag']
+        commenter.username = 'renamed'
+        commenter.save()
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, 'renamed')
+
+    def test_csrf_rotation_updates_post_etag(self):
+        """Новый CSRF-токен после входа меняет ETag страницы поста"""
+        url = self.urls[0]
+        self.authorized_client.cookies['csrftoken'] = 'a' * 64
+        etag = self.authorized_client.get(url)['ETag']
+        self.authorized_client.cookies['csrftoken'] = 'b' * 64
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.best = Post.objects.create(
+            text='Кошки, кошки и ещё раз кошки', author=cls.user)
+        cls.other = Post.objects.create(
+            text='Собаки лучше, чем кошки и попугаи', author=cls.user)
+        Post.objects.create(text='Про попугаев', author=cls.user)
+        Post.objects.bulk_create([
+            Post(text=f'Пост про кошек номер {i}', author=cls.user)
+            for i in range(12)
+        ])
+        search.rebuild()
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.url = reverse('posts:search')
+
+    def test_ranked_results(self):
+        """Поиск ранжирует результаты и учитывает правки постов"""
+        response = self.guest_client.get(self.url, {'q': 'кошки'})
+        self.assertEqual(list(response.context['page_obj']),
+                         [self.best, self.other])
+        post = Post.objects.get(pk=self.other.pk)
+        post.text = 'Собаки и попугаи'
+        post.save()
+        response = self.guest_client.get(self.url, {'q': 'кошки'})
+        self.assertEqual(list(response.context['page_obj']), [self.best])
+
+    def test_search_pages(self):
+        """Результаты поиска листаются курсором"""
+        first = self.guest_client.get(
+            self.url, {'q': 'кош'}).context['page_obj']
+        self.assertEqual(len(first), 10)
+        self.assertContains(
+            self.guest_client.get(self.url, {'q': 'кош'}), 'q=%D0%BA')
+        second = self.guest_client.get(
+            self.url, {'q': 'кош', 'cursor': first.next_cursor}
+        ).context['page_obj']
+        self.assertEqual(len(second), 4)
+        self.assertFalse(set(first) & set(second))
+
+    def test_archived_found(self):
+        """Архивные посты тоже находятся поиском"""
+        old = Post.objects.create(text='Древний пост про ящериц',
+                                  author=self.user)
+        archive.archive_batch(old.pub_date + timedelta(seconds=1), 100)
+        self.assertTrue(ArchivedPost.objects.filter(pk=old.pk).exists())
+        response = self.guest_client.get(self.url, {'q': 'ящериц'})
+        self.assertEqual([post.text for post in response.context['page_obj']],
+                         ['Древний пост про ящериц'])
+        search.rebuild()
+        response = self.guest_client.get(self.url, {'q': 'ящериц'})
+        self.assertEqual(len(response.context['page_obj']), 1)
+
+    def test_ranking_cached(self):
+        """Ранжирование считается один раз, страницы режутся из него"""
+        first = self.guest_client.get(
+            self.url, {'q': 'кош'}).context['page_obj']
+        with CaptureQueriesContext(connection) as queries:
+            second = self.guest_client.get(
+                self.url, {'q': 'кош', 'cursor': first.next_cursor}
+            ).context['page_obj']
+        self.assertFalse([query for query in queries
+                          if 'bm25' in query['sql']])
+        self.assertEqual(len(second), 4)
+        with override_settings(SEARCH_MAX_RESULTS=3):
+            cache.clear()
+            page = self.guest_client.get(
+                self.url, {'q': 'кош'}).context['page_obj']
+        self.assertEqual(len(page), 3)
+        self.assertIsNone(page.next_cursor)
+
+    def test_admin_search(self):
+        """Поиск в админке идёт через тот же индекс"""
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass')
+        client = Client()
+        client.force_login(admin)
+        response = client.get(reverse('admin:posts_post_changelist'),
+                              {'q': 'попуга'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+    def test_empty_query(self):
+        """Пустой запрос ничего не ищет"""
+        response = self.guest_client.get(self.url, {'q': ' , '})
+        self.assertEqual(len(response.context['page_obj']), 0)
+
 
 class CacheTests(TestCase):
     @classmethod
@@ -297,17 +541,159 @@ class CacheTests(TestCase):
                     group=self.group)
                 cache.clear()
                 first_state = self.authorized_client.get(page)
-                post.delete()
+                Post.objects.filter(pk=post.pk).update(text='Без сигнала')
                 second_state = self.authorized_client.get(page)
                 self.assertEqual(first_state.content,
                                  second_state.content,
-                                 ('До очистки кеша, пост существует'))
-                cache.clear()
+                                 'Страница должна отдаваться из кеша')
+                post.delete()
                 third_state = self.authorized_client.get(page)
                 self.assertNotEqual(first_state.content,
                                     third_state.content,
-                                    ('После обновления кеша, пост должен '
-                                     + 'отсутствовать'))
+                                    ('После удаления поста страница '
+                                     + 'должна обновиться сразу'))
+
+    def test_stale_page_while_rebuilding(self):
+        """Пока страницу пересобирает другой запрос, отдаётся старая копия"""
+        page = reverse('posts:index')
+        cache.clear()
+        first_state = self.authorized_client.get(page)
+        Post.objects.create(text='Свежий пост', author=self.user)
+        with mock.patch.object(cache_utils, '_acquire_lock',
+                               return_value=False):
+            stale_state = self.authorized_client.get(page)
+        self.assertEqual(first_state.content, stale_state.content)
+        fresh_state = self.authorized_client.get(page)
+        self.assertContains(fresh_state, 'Свежий пост')
+
+    def test_early_refresh(self):
+        """Копия, пересчёт которой долог, обновляется до истечения срока"""
+        entry = {
+            'generation': 1,
+            'expires': time.time() + 1,
+            'delta': 3600,
+        }
+        with mock.patch('random.random', return_value=0.5):
+            self.assertFalse(cache_utils._is_fresh(entry, 1, 1.0))
+        entry['delta'] = 0.001
+        with mock.patch('random.random', return_value=0.5):
+            self.assertTrue(cache_utils._is_fresh(entry, 1, 1.0))
+        self.assertFalse(cache_utils._is_fresh(entry, 2, 1.0))
+
+    def test_post_card_fragment_cache(self):
+        """Карточка поста кэшируется и сбрасывается при правке"""
+        page = reverse('posts:profile',
+                       kwargs={'username': self.user.username})
+        cache.clear()
+        self.authorized_client.get(page)
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигнала')
+        response = self.authorized_client.get(page)
+        self.assertContains(response, 'Тестовый пост')
+        group = Group.objects.get(pk=self.group.pk)
+        group.title = 'Новое название группы'
+        group.save()
+        response = self.authorized_client.get(page)
+        self.assertContains(response, 'Новое название группы')
+        self.assertContains(response, 'Без сигнала')
+
+    def test_generation_shared_between_processes(self):
+        """Поколение в базе: правку из другого процесса видно сразу"""
+        page = reverse('posts:index')
+        cache.clear()
+        self.guest_client.get(page)
+        # Другой процесс меняет базу, но не локальный кэш этого процесса.
+        Post.objects.bulk_create(
+            [Post(text='Пост соседа', author=self.user)])
+        CacheVersion.objects.filter(key=cache_utils.GENERATION_KEY).update(
+            value=F('value') + 1)
+        self.assertContains(self.guest_client.get(page), 'Пост соседа')
+
+    def test_card_version_shared_between_processes(self):
+        """Версия карточки в базе: правку из другого процесса видно сразу"""
+        page = reverse('posts:profile',
+                       kwargs={'username': self.user.username})
+        cache.clear()
+        self.guest_client.get(page)
+        # Другой процесс правит пост и поднимает версии в базе.
+        Post.objects.filter(pk=self.post.pk).update(text='Правка соседа')
+        CacheVersion.objects.update(value=F('value') + 1)
+        self.assertContains(self.guest_client.get(page), 'Правка соседа')
+
+    def test_login_keeps_cache(self):
+        """Вход пользователя не сбрасывает кэш страниц"""
+        generation = cache_utils.generation()
+        self.guest_client.force_login(self.user)
+        self.assertEqual(cache_utils.generation(), generation)
+
+
+class ThumbnailTests(TempKVStoreMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.image = (
+            b'\x47\x49\x46\x38\x39\x61\x02\x00'
+            b'\x01\x00\x80\x00\x00\x00\x00\x00'
+            b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+            b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+            b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+            b'\x0A\x00\x3B')
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def upload(self):
+        return SimpleUploadedFile(
+            name='thumb.gif', content=self.image, content_type='image/gif')
+
+    def test_upload_schedules_thumbnails(self):
+        """Создание поста с картинкой ставит варианты в очередь"""
+        with mock.patch.object(thumbnails.transaction, 'on_commit',
+                               side_effect=lambda func: func()), \
+                mock.patch.object(thumbnails, 'schedule') as schedule:
+            self.authorized_client.post(
+                reverse('posts:post_create'),
+                data={'text': 'С картинкой', 'image': self.upload()})
+        post = Post.objects.get(text='С картинкой')
+        schedule.assert_called_once_with(post.image.name, post.image.storage)
+
+    def test_resized_until_ready(self):
+        """Пока вариантов нет, картинки отдаются по ссылкам на ресайз"""
+        post = Post.objects.create(
+            text='Картинка', author=self.user, image=self.upload())
+        response = self.authorized_client.get(reverse('posts:index'))
+        resized = resize.resize_url(post.image.name, 960, 339)
+        self.assertContains(response, f'src="{resized}"')
+        self.assertNotContains(response, f'src="{post.image.url}"')
+        generation = cache_utils.generation()
+        variants = thumbnails.build_variants(
+            post.image.name, post.image.storage)
+        self.assertEqual([width for width, _ in variants['webp']], [480])
+        self.assertEqual(cache_utils.generation(), generation)
+        response = self.authorized_client.get(
+            reverse('posts:post_detail', args=[post.pk]))
+        webp_url = variants['webp'][0][1]
+        self.assertTrue(webp_url.endswith('.webp'))
+        self.assertContains(response, f'srcset="{webp_url} 480w"')
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, post.image_placeholder)
+        self.assertNotContains(response, '/resize/')
+
+    @override_settings(THUMBNAIL_WORKERS=0)
+    def test_workers_disabled(self):
+        """Пустой пул не ставит картинки в очередь"""
+        with mock.patch.object(thumbnails, 'executor') as executor:
+            self.assertFalse(thumbnails.schedule('posts/thumb.gif', None))
+        executor.assert_not_called()
+
+    def test_variant_widths(self):
+        """Варианты не шире исходной картинки"""
+        self.assertEqual(thumbnails.variant_widths(1000), [480, 960])
+        self.assertEqual(thumbnails.variant_widths(100), [480])
+        self.assertEqual(thumbnails.variant_geometry(480), '480x170')
 
 
 class FollowTests(TestCase):
@@ -387,3 +773,194 @@ class FollowTests(TestCase):
         post_text = response.context['page_obj'][0].text
         self.assertEqual(post_text, self.post.text,
                          'Пост после подписки не появился в подписках')
+
+    def test_timeline_fan_out(self):
+        """Проверка, что лента подписок наполняется и очищается"""
+        self.authorized_client.get(
+            reverse('posts:profile_follow',
+                    kwargs={'username': self.user.username}))
+        new_post = Post.objects.create(text='Новый пост', author=self.user)
+        self.assertEqual(
+            list(self.new_user.timeline.values_list('post', flat=True)),
+            [new_post.id, self.post.id],
+            'Пост не попал в ленту подписчика')
+        self.authorized_client.get(
+            reverse('posts:profile_unfollow',
+                    kwargs={'username': self.user.username}))
+        self.assertFalse(self.new_user.timeline.exists(),
+                         'Лента не очищена после отписки')
+
+    @override_settings(FEED_FANOUT_THRESHOLD=1)
+    def test_pulled_author_merged_on_read(self):
+        """Посты популярного автора подтягиваются в ленту при чтении"""
+        other = User.objects.create_user(username='other')
+        Follow.objects.create(user=self.new_user, author=other)
+        other_post = Post.objects.create(text='Чужой пост', author=other)
+        self.authorized_client.get(
+            reverse('posts:profile_follow',
+                    kwargs={'username': self.user.username}))
+        pulled_writes = timeline.stats['pulled_writes']
+        new_post = Post.objects.create(text='Новый пост', author=self.user)
+        self.assertEqual(timeline.stats['pulled_writes'], pulled_writes + 1)
+        self.assertFalse(self.new_user.timeline.exists(),
+                         'Пост популярного автора разложен по лентам')
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']),
+                         [new_post, other_post, self.post])
+        response = self.authorized_client.get(
+            reverse('posts:follow_index'), {'page': 1})
+        self.assertEqual(list(response.context['page_obj']),
+                         [new_post, other_post, self.post])
+
+    @override_settings(FEED_FANOUT_THRESHOLD=3, FEED_FANOUT_RELEASE_RATIO=0.5,
+                       FEED_WORKERS=0)
+    def test_feed_mode_hysteresis(self):
+        """Режим автора меняется с гистерезисом, ленты правятся в фоне"""
+        readers = [self.new_user] + [
+            User.objects.create_user(username=f'reader{number}')
+            for number in range(2)]
+        committed = []
+        with mock.patch.object(timeline.transaction, 'on_commit',
+                               committed.append):
+            for reader in readers:
+                Follow.objects.create(user=reader, author=self.user)
+        self.assertTrue(timeline.is_pulled(self.user.id))
+        # Записи, которые уборка ещё не стёрла, не дублируют пост.
+        self.assertTrue(self.new_user.timeline.exists())
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']), [self.post])
+        self.assertEqual(response.context['page_obj'].paginator.count, 1)
+        for callback in committed:
+            callback()
+        self.assertFalse(self.new_user.timeline.exists())
+        with mock.patch.object(timeline.transaction, 'on_commit',
+                               lambda func: func()):
+            Follow.objects.filter(user=readers[2]).delete()
+            self.assertTrue(timeline.is_pulled(self.user.id))
+            self.assertFalse(self.new_user.timeline.exists())
+            Follow.objects.filter(user=readers[1]).delete()
+        self.assertFalse(timeline.is_pulled(self.user.id))
+        self.assertEqual(
+            list(self.new_user.timeline.values_list('post', flat=True)),
+            [self.post.id])
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaTests(TestCase):
+    # Тестовые базы default и replica — разные, репликации между ними
+    # нет, поэтому реплика всегда «отстаёт».
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='writer')
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.profile_url = reverse('posts:profile', args=['writer'])
+
+    def test_reads_from_replica(self):
+        """Лента и профиль читаются из реплики"""
+        Post.objects.create(author=self.user, text='Только в default')
+        guest = Client()
+        response = guest.get(reverse('posts:index'))
+        self.assertEqual(len(response.context['page_obj']), 0)
+        self.assertEqual(guest.get(self.profile_url).status_code,
+                         HTTPStatus.NOT_FOUND)
+        self.assertEqual(Post.objects.using('replica').count(), 0)
+
+    def test_pinned_after_write(self):
+        """После записи автор читает из default и видит свой пост"""
+        response = self.client.post(
+            reverse('posts:post_create'), {'text': 'Новый пост'},
+            follow=True)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.context['page_obj'][0].text, 'Новый пост')
+        self.assertEqual(Post.objects.using('replica').count(), 0)
+        self.client.cookies.pop('db_pin')
+        self.assertEqual(self.client.get(self.profile_url).status_code,
+                         HTTPStatus.NOT_FOUND)
+
+    def test_pinned_after_follow(self):
+        """После подписки читатель видит её в профиле автора"""
+        User.objects.create_user(username='author')
+        response = self.client.get(
+            reverse('posts:profile_follow', args=['author']), follow=True)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertTrue(response.context['following'])
+
+    def test_lagging_replica_page_not_fresh(self):
+        """Страница из отстающей реплики не считается в кэше свежей"""
+        guest = Client()
+        Post.objects.create(author=self.user, text='Только в default')
+        # Чужая запись не уводит остальных читателей с реплики.
+        self.assertEqual(
+            len(guest.get(reverse('posts:index')).context['page_obj']), 0)
+        # Реплика догнала default.
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertContains(guest.get(reverse('posts:index')),
+                                'Только в default')
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test_group',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            text='Первый пост', author=cls.user, group=cls.group)
+        Post.objects.create(text='Второй пост', author=cls.user)
+        Comment.objects.create(post=cls.post, author=cls.user, text='Да')
+        Comment.objects.create(
+            post=Post.objects.create(
+                text='Чужой пост',
+                author=User.objects.create_user(username='stranger')),
+            author=cls.user, text='Нет')
+        cls.url = reverse('posts:profile_export', args=['author'])
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def test_export_jsonl(self):
+        """Выгрузка отдаётся потоком записей, пригодных для import_data"""
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        self.assertIn('author.jsonl', response['Content-Disposition'])
+        records = [json.loads(line) for line in b''.join(
+            response.streaming_content).decode().splitlines()]
+        self.assertEqual(
+            [(record['model'], record.get('text')) for record in records],
+            [('user', None), ('group', None), ('post', 'Первый пост'),
+             ('post', 'Второй пост'), ('comment', 'Да'), ('comment', 'Нет')])
+        self.assertEqual(records[1]['slug'], 'test_group')
+        self.assertEqual(records[2]['group'], 'test_group')
+        self.assertEqual(
+            (records[4]['post'], records[4]['post_author']),
+            (self.post.pk, 'author'))
+        # Комментарий к чужому посту ссылается на пост и его автора.
+        self.assertEqual(records[5]['post_author'], 'stranger')
+
+    def test_export_csv_zip(self):
+        """CSV можно получить сжатым в zip на лету"""
+        response = self.client.get(self.url, {'format': 'csv', 'zip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(
+            io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), ['author.csv'])
+        lines = archive.read('author.csv').decode().splitlines()
+        self.assertEqual(lines[0], ','.join(export.CSV_FIELDS))
+        self.assertEqual(len(lines), 7)
+
+    def test_export_forbidden(self):
+        """Чужие данные выгрузить нельзя"""
+        other = Client()
+        other.force_login(User.objects.create_user(username='other'))
+        self.assertEqual(other.get(self.url).status_code,
+                         HTTPStatus.FORBIDDEN)
+        self.assertEqual(Client().get(self.url).status_code,
+                         HTTPStatus.FOUND)
@@ -0,0 +1,25 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import override_settings
+from sorl.thumbnail import default
+
+from .. import kvstore
+
+
+class TempKVStoreMixin:
+    """Ключи миниатюр sorl пишутся во временный файл, а не в файл проекта."""
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        settings = override_settings(
+            THUMBNAIL_KVSTORE_FILE=os.path.join(tmp, 'kv.sqlite3'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        patcher = mock.patch.object(default, 'kvstore', kvstore.KVStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
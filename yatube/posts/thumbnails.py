@@ -0,0 +1,177 @@
+"""
+Фоновая подготовка вариантов картинок постов.
+
+Для каждой картинки вырезаются варианты нескольких ширин в JPEG и WebP,
+а их адреса сохраняются в Post.image_variants: шаблоны строят srcset по
+этому полю, не обращаясь к sorl. Варианты режутся в пуле потоков сразу
+после сохранения картинки в post_create и post_edit; пока их нет,
+шаблоны показывают исходную картинку.
+
+DeferredBackend не режет миниатюры внутри запроса и для {% thumbnail %}:
+если миниатюры нет, он ставит картинку в очередь и отдаёт оригинал.
+"""
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import connections, transaction
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+
+from .cache import bump_version
+from .images import CROP_RATIO
+from .models import ArchivedPost, Post
+
+# Варианты вырезаются с пропорциями прежней миниатюры 960x339.
+VARIANT_WIDTHS = (480, 960, 1440)
+VARIANT_FORMATS = ('JPEG', 'WEBP')
+VARIANT_OPTIONS = {'crop': 'center', 'upscale': True}
+DEFAULT_WORKERS = 2
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def workers():
+    """Размер пула; 0 выключает фоновую нарезку."""
+    return getattr(settings, 'THUMBNAIL_WORKERS', DEFAULT_WORKERS)
+
+
+def executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=workers(),
+                thread_name_prefix='thumbnails',
+            )
+        return _executor
+
+
+def variant_geometry(width):
+    return f'{width}x{round(width * CROP_RATIO)}'
+
+
+def variant_widths(source_width):
+    """Ширины не больше исходной; самая узкая режется всегда."""
+    if not source_width:
+        return list(VARIANT_WIDTHS)
+    widths = [width for width in VARIANT_WIDTHS if width <= source_width]
+    return widths or [VARIANT_WIDTHS[0]]
+
+
+def schedule(name, storage):
+    """Ставит картинку в очередь, если её варианты ещё не готовятся."""
+    if not workers():
+        return False
+    with _lock:
+        if name in _pending:
+            return False
+        _pending.add(name)
+    executor().submit(_work, name, storage)
+    return True
+
+
+def schedule_on_commit(name, storage):
+    # Воркер читает файл и пост из другого соединения, поэтому ждёт,
+    # пока транзакция с ними зафиксируется.
+    transaction.on_commit(partial(schedule, name, storage))
+
+
+def _source_width(name):
+    for model in (Post, ArchivedPost):
+        width = model.objects.filter(image=name).values_list(
+            'image_width', flat=True).first()
+        if width:
+            return width
+    return None
+
+
+def build_variants(name, storage):
+    """
+    Режет варианты картинки, записывает их адреса всем постам с ней, в
+    том числе архивным, и сбрасывает кэш их карточек. Кэш списков не
+    сбрасывается: до его обновления они показывают картинку по ссылке на
+    ресайз. Возвращает {формат: [[ширина, url]]}.
+    """
+    if not storage.exists(name):
+        logger.warning('image %s does not exist, variants skipped', name)
+        return None
+    widths = variant_widths(_source_width(name))
+    source = ImageFile(name, storage)
+    backend = ThumbnailBackend()
+    variants = {
+        image_format.lower(): [
+            [width, backend.get_thumbnail(
+                source, variant_geometry(width), format=image_format,
+                **VARIANT_OPTIONS).url]
+            for width in widths
+        ]
+        for image_format in VARIANT_FORMATS
+    }
+    for model in (Post, ArchivedPost):
+        posts = model.objects.filter(image=name)
+        post_ids = list(posts.values_list('id', flat=True))
+        posts.update(image_variants=json.dumps(variants))
+        for post_id in post_ids:
+            bump_version('post', post_id)
+    return variants
+
+
+def _work(name, storage):
+    try:
+        build_variants(name, storage)
+    except Exception:
+        logger.exception('variants for %s failed', name)
+    finally:
+        with _lock:
+            _pending.discard(name)
+        # Соединения с базой у каждого потока свои.
+        connections.close_all()
+
+
+def pregenerate(post):
+    """Ставит в очередь варианты картинки поста."""
+    if post.image:
+        schedule_on_commit(post.image.name, post.image.storage)
+
+
+class DeferredBackend(ThumbnailBackend):
+    """
+    Бэкенд sorl, который отдаёт только готовые миниатюры. Если миниатюры
+    нет, она ставится в очередь, а вместо неё возвращается оригинал.
+    """
+
+    def get_thumbnail(self, file_, geometry_string, **options):
+        if not file_:
+            raise ValueError('falsey file_ argument in get_thumbnail()')
+        source = ImageFile(file_)
+        name = self._get_thumbnail_filename(
+            source, geometry_string, self._full_options(source, options))
+        cached = default.kvstore.get(ImageFile(name, default.storage))
+        if cached:
+            return cached
+        schedule_on_commit(source.name, source.storage)
+        return source
+
+    def _full_options(self, source, options):
+        # Те же умолчания, что добавляет ThumbnailBackend.get_thumbnail:
+        # от них зависит имя файла миниатюры.
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        return options
@@ -0,0 +1,393 @@
+"""
+Лента подписок с гибридной раскладкой.
+
+Посты обычных авторов при публикации раскладываются в TimelineEntry
+каждого подписчика. Авторы, у которых подписчиков не меньше
+FEED_FANOUT_THRESHOLD, в ленты не пишутся: их посты подтягиваются при
+чтении и вливаются в страницу в порядке (pub_date, id).
+
+Режим автора хранится в UserCounters.feed_pulled и переключается с
+гистерезисом: подтягивание выключается, только когда подписчиков
+становится меньше FEED_FANOUT_THRESHOLD * FEED_FANOUT_RELEASE_RATIO.
+Иначе автор у порога при каждой подписке и отписке заново раскладывал бы
+и стирал все свои посты. Уборка записей и дораскладка постов автора идут
+в фоновом потоке после фиксации транзакции.
+
+Архивные посты остаются в лентах: записи ссылаются на id поста без
+внешнего ключа, а посты страницы достаются по id из обоих ярусов.
+"""
+import logging
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .models import (ArchivedPost, Follow, Post, TimelineEntry,
+                     UserCounters)
+from .paginators import (POST_KEYS, POSTS_ON_PAGE, CursorPaginator,
+                         get_page, keyset_slice)
+
+FEED_KEYS = ('pub_date', 'post_id')
+BATCH_SIZE = 500
+DEFAULT_FANOUT_THRESHOLD = 10000
+DEFAULT_RELEASE_RATIO = 0.9
+DEFAULT_WORKERS = 1
+
+logger = logging.getLogger(__name__)
+
+# Счётчики раскладки в рамках процесса:
+# writes, pulled_writes, rows, max_rows.
+stats = Counter()
+
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def fanout_threshold():
+    return getattr(settings, 'FEED_FANOUT_THRESHOLD',
+                   DEFAULT_FANOUT_THRESHOLD)
+
+
+def release_threshold():
+    """Ниже стольких подписчиков посты автора снова раскладываются."""
+    return fanout_threshold() * getattr(
+        settings, 'FEED_FANOUT_RELEASE_RATIO', DEFAULT_RELEASE_RATIO)
+
+
+def executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'FEED_WORKERS',
+                                    DEFAULT_WORKERS),
+                thread_name_prefix='timeline',
+            )
+        return _executor
+
+
+def _record(rows):
+    """Учитывает пост в stats; rows — None, если автор подтягивается."""
+    with _lock:
+        stats['writes'] += 1
+        if rows is None:
+            stats['pulled_writes'] += 1
+        else:
+            stats['rows'] += rows
+            stats['max_rows'] = max(stats['max_rows'], rows)
+
+
+def is_pulled(author_id):
+    """Автор слишком популярен, чтобы раскладывать его посты при записи."""
+    return UserCounters.objects.filter(
+        user_id=author_id, feed_pulled=True).exists()
+
+
+def pulled_authors(user_id):
+    """Авторы из подписок читателя, чьи посты подтягиваются при чтении."""
+    followed = Follow.objects.filter(user_id=user_id).values('author_id')
+    return list(UserCounters.objects.filter(
+        user_id__in=followed,
+        feed_pulled=True,
+    ).values_list('user_id', flat=True))
+
+
+def update_mode(author_id):
+    """
+    Переключает режим автора по числу подписчиков и ставит в очередь
+    уборку или дораскладку его постов. Возвращает, подтягивается ли он.
+    """
+    return author_id in update_modes([author_id])
+
+
+def update_modes(author_ids):
+    """update_mode для нескольких авторов; возвращает подтягиваемых."""
+    pulled = set()
+    for author_id, followers, feed_pulled in UserCounters.objects.filter(
+            user_id__in=author_ids).values_list(
+            'user_id', 'followers', 'feed_pulled'):
+        if not feed_pulled and followers >= fanout_threshold():
+            UserCounters.objects.filter(user_id=author_id).update(
+                feed_pulled=True)
+            _schedule(drop_author, author_id)
+            feed_pulled = True
+        elif feed_pulled and followers < release_threshold():
+            _schedule(release_author, author_id)
+        if feed_pulled:
+            pulled.add(author_id)
+    return pulled
+
+
+def _schedule(task, author_id):
+    # Воркер читает из другого соединения, поэтому ждёт фиксации.
+    transaction.on_commit(partial(_submit, task, author_id))
+
+
+def _submit(task, author_id):
+    with _lock:
+        if (task, author_id) in _pending:
+            return
+        _pending.add((task, author_id))
+    if getattr(settings, 'FEED_WORKERS', DEFAULT_WORKERS):
+        executor().submit(_work, task, author_id)
+    else:
+        _work(task, author_id, close=False)
+
+
+def _work(task, author_id, close=True):
+    try:
+        task(author_id)
+    except Exception:
+        logger.exception('timeline task %s for author %s failed',
+                         task.__name__, author_id)
+    finally:
+        with _lock:
+            _pending.discard((task, author_id))
+        if close:
+            # Соединения с базой у каждого потока свои.
+            connections.close_all()
+
+
+def drop_author(author_id):
+    """Стирает из лент записи автора, который стал подтягиваться."""
+    removed = TimelineEntry.objects.filter(
+        _author_posts([author_id])).delete()[0]
+    logger.info('author %s is pulled on read, %s timeline rows dropped',
+                author_id, removed)
+    return removed
+
+
+def release_author(author_id):
+    """
+    Раскладывает посты автора, опустившегося ниже порога, всем его
+    подписчикам и только потом выключает подтягивание: лента не теряет
+    его посты на время раскладки. Посты, опубликованные за это время,
+    дораскладываются вторым проходом.
+    """
+    followers = UserCounters.objects.filter(
+        user_id=author_id).values_list('followers', flat=True).first()
+    if followers is None or followers >= release_threshold():
+        return 0
+    started = timezone.now()
+    rows = _fan_out_author(author_id)
+    UserCounters.objects.filter(user_id=author_id).update(
+        feed_pulled=False)
+    rows += _fan_out_author(author_id, since=started)
+    logger.info('author %s is fanned out again, %s timeline rows written',
+                author_id, rows)
+    return rows
+
+
+def _fan_out_author(author_id, since=None):
+    followers = Follow.objects.filter(
+        author_id=author_id).values_list('user_id', flat=True)
+    return sum(
+        _author_entries(user_id, author_id, since)
+        for user_id in followers.iterator())
+
+
+def push_post(post):
+    """Раскладывает новый пост в ленты всех подписчиков автора."""
+    return push_posts([post])
+
+
+def push_posts(posts):
+    """
+    Раскладывает пачку новых постов: подтягиваемые авторы и подписчики
+    читаются двумя запросами на всю пачку, а не на каждый пост.
+    """
+    author_ids = {post.author_id for post in posts}
+    pulled = set(UserCounters.objects.filter(
+        user_id__in=author_ids,
+        feed_pulled=True,
+    ).values_list('user_id', flat=True))
+    followers = defaultdict(list)
+    for author_id, user_id in Follow.objects.filter(
+            author_id__in=author_ids - pulled).values_list(
+            'author_id', 'user_id').iterator():
+        followers[author_id].append(user_id)
+    fanned_out = []
+    for post in posts:
+        if post.author_id in pulled:
+            _record(None)
+            logger.info(
+                'post %s: author %s is pulled on read, fan-out skipped',
+                post.pk, post.author_id)
+            continue
+        rows = len(followers[post.author_id])
+        _record(rows)
+        logger.info('post %s: fanned out to %s timeline rows', post.pk, rows)
+        fanned_out.append(post)
+    return _bulk_insert(
+        TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+        for post in fanned_out
+        for user_id in followers[post.author_id]
+    )
+
+
+def add_author(user_id, author_id):
+    """Добавляет в ленту читателя все посты нового автора."""
+    if update_mode(author_id):
+        return 0
+    return _author_entries(user_id, author_id)
+
+
+def add_follows(follows):
+    """
+    Добавляет в ленты читателей посты авторов из пачки подписок (пар
+    читатель, автор): посты читаются одним запросом на ярус для всей
+    пачки, а не на каждую подписку.
+    """
+    readers = defaultdict(list)
+    for user_id, author_id in follows:
+        readers[author_id].append(user_id)
+    authors = set(readers) - update_modes(list(readers))
+    if not authors:
+        return 0
+    entries = (
+        TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+        for model in (Post, ArchivedPost)
+        for author_id, post_id, pub_date in model.objects.filter(
+            author_id__in=authors).values_list(
+            'author_id', 'id', 'pub_date').iterator()
+        for user_id in readers[author_id]
+    )
+    return _bulk_insert(entries)
+
+
+def _author_entries(user_id, author_id, since=None):
+    posts = {'author_id': author_id}
+    if since is not None:
+        posts['pub_date__gte'] = since
+    entries = (
+        TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+        for model in (Post, ArchivedPost)
+        for post_id, pub_date in model.objects.filter(
+            **posts).values_list('id', 'pub_date').iterator()
+    )
+    return _bulk_insert(entries)
+
+
+def _author_posts(author_ids):
+    return Q(post_id__in=Post.objects.filter(
+        author_id__in=author_ids).values('id')) | Q(
+        post_id__in=ArchivedPost.objects.filter(
+            author_id__in=author_ids).values('id'))
+
+
+def remove_author(user_id, author_id):
+    """
+    Убирает из ленты читателя посты автора после отписки. Если автор
+    опустился ниже порога, его посты в фоне раскладываются оставшимся
+    подписчикам.
+    """
+    removed = TimelineEntry.objects.filter(
+        _author_posts([author_id]), user_id=user_id).delete()[0]
+    update_mode(author_id)
+    return removed
+
+
+def rebuild(user_id):
+    """Пересобирает ленту читателя с нуля по его подпискам."""
+    TimelineEntry.objects.filter(user_id=user_id).delete()
+    pulled = pulled_authors(user_id)
+    entries = (
+        TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+        for model in (Post, ArchivedPost)
+        for post_id, pub_date in model.objects.filter(
+            author__following__user_id=user_id
+        ).exclude(
+            author_id__in=pulled
+        ).values_list('id', 'pub_date').iterator()
+    )
+    return _bulk_insert(entries)
+
+
+def posts_by_id(ids):
+    """Посты по id из Post и из архива."""
+    posts = Post.objects.select_related('author', 'group').in_bulk(ids)
+    missing = [post_id for post_id in ids if post_id not in posts]
+    if missing:
+        posts.update(ArchivedPost.objects.select_related(
+            'author', 'group').in_bulk(missing))
+    return posts
+
+
+class HybridFeedPaginator(CursorPaginator):
+    """
+    Курсорная выдача, сливающая разложенные записи ленты с постами
+    подтягиваемых авторов. Объекты страницы — посты.
+    """
+
+    def __init__(self, entries, pulled_posts, per_page, **kwargs):
+        super().__init__(entries, per_page, keys=FEED_KEYS, **kwargs)
+        # Запросы к обоим ярусам или None, если подтягивать некого.
+        self.pulled_posts = pulled_posts or []
+
+    def key_values(self, post):
+        return [post.pub_date, post.id]
+
+    def fetch(self, values, older, limit):
+        posts = posts_by_id([
+            entry.post_id for entry in super().fetch(values, older, limit)
+        ])
+        for queryset in self.pulled_posts:
+            for post in keyset_slice(queryset, POST_KEYS,
+                                     values, older, limit):
+                posts.setdefault(post.id, post)
+        merged = sorted(posts.values(), key=self.key_values, reverse=True)
+        return merged[:limit] if older else merged[-limit:]
+
+    @cached_property
+    def count(self):
+        return self.object_list.count() + sum(
+            queryset.count() for queryset in self.pulled_posts)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        objects = self.fetch(None, True, top)[bottom:top]
+        return self._get_page(objects, number, self)
+
+
+def feed_page(user, request):
+    """Страница ленты подписок: диапазонное чтение по индексу ленты."""
+    entries = TimelineEntry.objects.filter(user=user)
+    authors = pulled_authors(user.id)
+    if authors:
+        # Записи, которые фоновая уборка ещё не стёрла, не должны
+        # повторять подтянутые посты и попадать в count дважды.
+        entries = entries.exclude(_author_posts(authors))
+    pulled_posts = [
+        model.objects.select_related('author', 'group').filter(
+            author_id__in=authors)
+        for model in (Post, ArchivedPost)
+    ] if authors else None
+    return get_page(
+        HybridFeedPaginator(entries, pulled_posts, POSTS_ON_PAGE), request)
+
+
+def _bulk_insert(entries):
+    created = 0
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= BATCH_SIZE:
+            created += _flush(batch)
+            batch = []
+    if batch:
+        created += _flush(batch)
+    return created
+
+
+def _flush(batch):
+    TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+    return len(batch)
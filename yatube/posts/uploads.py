@@ -0,0 +1,97 @@
+"""
+Обработка загруженных картинок перед сохранением.
+
+Картинка поворачивается по EXIF, теряет метаданные, уменьшается до
+POST_IMAGE_MAX_SIDE по большей стороне и пережимается в
+POST_IMAGE_FORMAT с качеством POST_IMAGE_QUALITY. Если ничего из этого
+не требовалось и пережатый файл не меньше исходного, остаётся исходный.
+Анимации не трогаются, чтобы не потерять кадры.
+"""
+import io
+import logging
+import os
+from collections import Counter
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image, ImageOps
+
+DEFAULT_MAX_SIDE = 2048
+DEFAULT_QUALITY = 85
+DEFAULT_FORMAT = 'JPEG'
+FORMATS = {
+    'JPEG': ('.jpg', 'image/jpeg'),
+    'WEBP': ('.webp', 'image/webp'),
+}
+METADATA_KEYS = ('exif', 'icc_profile', 'xmp', 'XML:com.adobe.xmp',
+                 'comment')
+ORIENTATION_TAG = 0x0112
+
+logger = logging.getLogger(__name__)
+
+# Счётчики в рамках процесса: uploads, bytes_in, bytes_out.
+stats = Counter()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _needs_processing(image, max_side):
+    if any(key in image.info for key in METADATA_KEYS):
+        return True
+    if image.getexif().get(ORIENTATION_TAG, 1) != 1:
+        return True
+    return max(image.size) > max_side
+
+
+def flatten(image, keep_alpha):
+    has_alpha = (image.mode in ('RGBA', 'LA')
+                 or 'transparency' in image.info)
+    if not has_alpha:
+        return image.convert('RGB')
+    image = image.convert('RGBA')
+    if keep_alpha:
+        return image
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def normalize(upload):
+    """
+    Файл для сохранения. Экономия попадает в stats и в лог. Битая
+    картинка даёт OSError или Image.DecompressionBombError.
+    """
+    max_side = _setting('POST_IMAGE_MAX_SIDE', DEFAULT_MAX_SIDE)
+    image_format = _setting('POST_IMAGE_FORMAT', DEFAULT_FORMAT)
+    extension, content_type = FORMATS[image_format]
+    upload.seek(0)
+    with Image.open(upload) as image:
+        if getattr(image, 'is_animated', False):
+            upload.seek(0)
+            return upload
+        required = _needs_processing(image, max_side)
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        image = flatten(image, keep_alpha=image_format == 'WEBP')
+        buffer = io.BytesIO()
+        image.save(buffer, image_format,
+                   quality=_setting('POST_IMAGE_QUALITY', DEFAULT_QUALITY),
+                   optimize=True, progressive=True)
+    upload.seek(0)
+    processed = buffer.getvalue()
+    if not required and len(processed) >= upload.size:
+        _report(upload.name, upload.size, upload.size)
+        return upload
+    _report(upload.name, upload.size, len(processed))
+    name = os.path.splitext(upload.name)[0] + extension
+    return SimpleUploadedFile(name, processed, content_type)
+
+
+def _report(name, size_in, size_out):
+    stats['uploads'] += 1
+    stats['bytes_in'] += size_in
+    stats['bytes_out'] += size_out
+    logger.info('upload %s: %s -> %s bytes, saved %s',
+                name, size_in, size_out, size_in - size_out)
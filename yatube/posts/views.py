@@ -1,22 +1,40 @@
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import condition
+from PIL import Image
 
+from core.routers import pin, read_from_replica
+
+from . import (archive, counters, etags, export, resize, search,
+               thumbnails, timeline)
+from .cache import versioned_cache_page
 from .forms import CommentForm, PostForm
-from .models import Comment, Follow, Group, Post
-from .paginators import paginator
+from .models import ArchivedPost, Comment, Follow, Group, Post
+from .paginators import COMMENT_KEYS, COMMENTS_ON_PAGE, CursorPaginator
 
-CACHE_TIME = 20
+CACHE_TIME = 60 * 60
+# Правка не пишет счётчик комментариев: его меняют сигналы, и значение,
+# прочитанное до правки, могло устареть.
+EDIT_FIELDS = [
+    field.name for field in Post._meta.concrete_fields
+    if not field.primary_key and field.name != 'comments_count'
+]
 
 User = get_user_model()
 
 
-@cache_page(CACHE_TIME, key_prefix='index_page')
+@read_from_replica
+@versioned_cache_page(CACHE_TIME, key_prefix='index_page')
 def index(request):
     post_list = Post.objects.select_related(
         'author', 'group')
-    page_obj = paginator(post_list, request)
+    archived = ArchivedPost.objects.select_related('author', 'group')
+    page_obj = archive.paginator(post_list, archived, request)
     context = {
         'title': 'Это главная страница проекта Yatube',
         'page_obj': page_obj,
@@ -24,10 +42,13 @@ def index(request):
     return render(request, 'posts/index.html', context)
 
 
+@read_from_replica
+@condition(etag_func=etags.group_posts)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
     post_list = group.posts.select_related('author')
-    page_obj = paginator(post_list, request)
+    archived = group.archived_posts.select_related('author')
+    page_obj = archive.paginator(post_list, archived, request)
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -36,11 +57,16 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@read_from_replica
+@condition(etag_func=etags.profile)
 def profile(request, username):
     author = get_object_or_404(User, username=username)
     post_list = Post.objects.select_related('author', 'group').filter(
-        author__username=username)
-    page_obj = paginator(post_list, request)
+        author=author)
+    archived = ArchivedPost.objects.select_related('author', 'group').filter(
+        author=author)
+    page_obj = archive.paginator(post_list, archived, request)
+    author_counters = counters.get_counters(author.id)
     if request.user.is_authenticated:
         following = Follow.objects.filter(
             user=request.user,
@@ -49,7 +75,8 @@ def profile(request, username):
         following = False
     context = {
         'author': author,
-        'count': post_list.count(),
+        'count': author_counters.posts,
+        'counters': author_counters,
         'following': following,
         'page_obj': page_obj,
         'title': f'Профайл пользователя {author}',
@@ -57,13 +84,17 @@ def profile(request, username):
     return render(request, 'posts/profile.html', context)
 
 
+@read_from_replica
+@condition(etag_func=etags.post_detail)
 def post_detail(request, post_id):
-    post = get_object_or_404(
-        Post.objects.select_related('author', 'group'), id=post_id)
+    post = archive.find_post(post_id)
+    if post is None:
+        raise Http404
     form = CommentForm()
-    comments = Comment.objects.select_related('author').filter(post=post_id)
+    comments = comments_page(post, None)
     context = {
         'author': post.author,
+        'author_counters': counters.get_counters(post.author_id),
         'comments': comments,
         'form': form,
         'post': post,
@@ -72,6 +103,24 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+def comments_page(post, cursor):
+    comments = Comment.objects.select_related('author').filter(
+        post_id=post.pk)
+    return CursorPaginator(
+        comments, COMMENTS_ON_PAGE, keys=COMMENT_KEYS).cursor_page(cursor)
+
+
+def post_comments(request, post_id):
+    post = archive.find_post(post_id)
+    if post is None:
+        raise Http404
+    context = {
+        'comments': comments_page(post, request.GET.get('cursor')),
+        'post': post,
+    }
+    return render(request, 'includes/comments.html', context)
+
+
 @login_required
 def post_create(request):
     form = PostForm(
@@ -82,22 +131,35 @@ def post_create(request):
         return render(request, 'posts/edit_post.html', {'form': form})
     post = form.save(commit=False)
     post.author = request.user
-    post.save()
+    with transaction.atomic():
+        post.save()
+        thumbnails.pregenerate(post)
     return redirect('posts:profile', post.author)
 
 
 @login_required
 def post_edit(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = archive.find_post(post_id)
+    if post is None:
+        raise Http404
     if post.author != request.user:
         return redirect('posts:post_detail', post_id=post_id)
+    archived = isinstance(post, ArchivedPost)
+    if archived:
+        # Из архива пост возвращается только при сохранении правки.
+        post = archive.as_post(post)
     form = PostForm(
         request.POST or None,
         files=request.FILES or None,
         instance=post
     )
     if form.is_valid():
-        form.save()
+        with transaction.atomic():
+            if archived:
+                archive.restore(post_id)
+            form.save(commit=False).save(update_fields=EDIT_FIELDS)
+            if 'image' in form.changed_data:
+                thumbnails.pregenerate(post)
         return redirect('posts:post_detail', post_id=post_id)
     context = {
         'post': post,
@@ -109,22 +171,32 @@ def post_edit(request, post_id):
 
 @login_required
 def add_comment(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    if archive.find_post(post_id) is None:
+        raise Http404
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
         comment.author = request.user
-        comment.post = post
-        comment.save()
-        return redirect('posts:post_detail', post_id=post_id)
-    return render(request, 'includes/comments.html', {'form': form,
-                  'post': post})
+        with transaction.atomic():
+            comment.post = archive.hot_post(post_id)
+            comment.save()
+    return redirect('posts:post_detail', post_id=post_id)
 
 
+def post_search(request):
+    query = request.GET.get('q', '').strip()
+    context = {
+        'page_obj': search.search_page(query, request.GET.get('cursor')),
+        'q': query,
+        'title': f'Поиск: {query}' if query else 'Поиск',
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@read_from_replica
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    page_obj = paginator(post_list, request)
+    page_obj = timeline.feed_page(request.user, request)
     context = {
         'page_obj': page_obj,
         'title': 'Страница с подписками',
@@ -138,7 +210,9 @@ def profile_follow(request, username):
     author = User.objects.get(username=username)
     is_follower = Follow.objects.filter(user=user, author=author)
     if user != author and not is_follower.exists():
-        Follow.objects.create(user=user, author=author)
+        with transaction.atomic():
+            Follow.objects.create(user=user, author=author)
+        pin(request)
     return redirect('posts:profile', username=username)
 
 
@@ -148,4 +222,46 @@ def profile_unfollow(request, username):
     is_follower = Follow.objects.filter(user=request.user, author=author)
     if is_follower.exists():
         is_follower.delete()
+        pin(request)
     return redirect('posts:profile', username=author)
+
+
+@login_required
+def profile_export(request, username):
+    author = get_object_or_404(User, username=username)
+    if request.user != author and not request.user.is_staff:
+        raise PermissionDenied
+    file_format = request.GET.get('format', 'jsonl')
+    if file_format not in export.FORMATS:
+        raise Http404
+    content, content_type, filename = export.stream(
+        author, file_format, compress=request.GET.get('zip') == '1')
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def image_resize(request, width, height, crop, image_format, name):
+    if not resize.is_valid(request.GET.get('s'), width, height, crop,
+                           image_format, name):
+        raise Http404
+    key = resize.cache_key(width, height, crop, image_format, name)
+    etag = f'"{key}"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+    disk_cache = resize.disk_cache()
+    path = disk_cache.get(key)
+    if path is None:
+        storage = Post._meta.get_field('image').storage
+        if not storage.exists(name):
+            raise Http404
+        try:
+            with storage.open(name) as file:
+                data = resize.render(
+                    file, width, height, crop, image_format)
+        except (OSError, Image.DecompressionBombError):
+            raise Http404
+        path = disk_cache.put(key, data)
+    _, content_type = resize.FORMATS[image_format]
+    return resize.file_response(request, path, content_type, etag)
@@ -57,6 +57,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.ReplicaPinningMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
@@ -90,9 +91,21 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+    },
+    # Копия default, которую обновляет внешняя репликация.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db_replica.sqlite3'),
+    },
 }
 
+# Ленты, профили и страницы постов читают из этих баз; пустой список —
+# всё читается из default. После записи пользователь REPLICA_PIN_SECONDS
+# секунд читает только из default.
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+DATABASE_REPLICAS = []
+REPLICA_PIN_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -154,8 +167,46 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 
+# Кэш у каждого процесса свой: в нём лежат только копии страниц и
+# карточек. Поколение страниц, по которому копия считается свежей,
+# хранится в базе и общее для всех процессов.
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
+
+
+# Авторы, у которых подписчиков не меньше порога, не раскладываются
+# в ленты при публикации, а подтягиваются при чтении ленты подписок.
+FEED_FANOUT_THRESHOLD = 10000
+# Раскладка снова включается, когда подписчиков меньше порога, умноженного
+# на эту долю. Уборка и дораскладка лент идут в фоновом пуле потоков.
+FEED_FANOUT_RELEASE_RATIO = 0.9
+FEED_WORKERS = 1
+
+
+# Миниатюры режутся в фоновом пуле потоков, а пока их нет, шаблоны
+# показывают исходную картинку. THUMBNAIL_WORKERS = 0 выключает нарезку.
+THUMBNAIL_BACKEND = 'posts.thumbnails.DeferredBackend'
+THUMBNAIL_WORKERS = 2
+# Ключи миниатюр: LRU в памяти процесса перед общим файлом SQLite.
+THUMBNAIL_KVSTORE = 'posts.kvstore.KVStore'
+THUMBNAIL_KVSTORE_FILE = os.path.join(BASE_DIR, 'thumbnail_kvstore.sqlite3')
+THUMBNAIL_KVSTORE_LRU_SIZE = 10000
+
+# Загруженные картинки поворачиваются по EXIF, очищаются от метаданных,
+# уменьшаются до POST_IMAGE_MAX_SIDE и пережимаются.
+POST_IMAGE_MAX_SIDE = 2048
+POST_IMAGE_FORMAT = 'JPEG'
+POST_IMAGE_QUALITY = 85
+
+# Дисковый кэш картинок, нарезанных по подписанным ссылкам /resize/.
+RESIZE_CACHE_DIR = os.path.join(BASE_DIR, 'resize_cache')
+RESIZE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Посты старше этого числа дней команда archive_posts переносит в архив.
+POST_ARCHIVE_AFTER_DAYS = 365
+
+# Поиск ранжирует не больше стольких результатов запроса.
+SEARCH_MAX_RESULTS = 1000
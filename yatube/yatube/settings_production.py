@@ -0,0 +1,15 @@
+"""
+Настройки боевого сервера: DJANGO_SETTINGS_MODULE=yatube.settings_production.
+"""
+from core.db import PRODUCTION_PRAGMAS
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES
+
+DATABASES['default'].update({
+    # transaction.atomic начинается с BEGIN IMMEDIATE.
+    'ENGINE': 'core.backends.sqlite3',
+    # Соединение живёт между запросами, а не открывается каждый раз.
+    'CONN_MAX_AGE': 600,
+    'PRAGMAS': PRODUCTION_PRAGMAS,
+})